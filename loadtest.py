@@ -0,0 +1,553 @@
+"""Нагрузочный и длительный (soak) тест бота без внешних сервисов.
+
+Поднимает локальные поддельные Telegram Bot API и Mistral API, запускает
+приложение из main.py (build_application) на временных файлах данных и
+прогоняет синтетический или записанный поток обновлений с заданной частотой.
+В конце печатает пропускную способность, задержки p50/p95/p99, ошибки
+и рост памяти.
+
+Примеры:
+    python loadtest.py --rate 20 --duration 60 --users 200
+    python loadtest.py --rate 50 --updates 5000 --mistral-latency 800 --mistral-error-rate 0.05
+    python loadtest.py --replay updates.jsonl --rate 10 --loop --duration 3600
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+from urllib.parse import parse_qs
+
+import numpy as np
+
+import main
+from telegram import Update
+from telegram.ext import Application, AIORateLimiter, TypeHandler
+
+FAKE_TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot"}
+FIRST_USER_ID = 1000
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+# === ЛОКАЛЬНЫЙ HTTP-СЕРВЕР ===
+
+async def serve_http(handler, host: str = "127.0.0.1"):
+    """Минимальный HTTP/1.1 сервер с keep-alive; handler(method, path, headers, body) -> (status, dict)"""
+    async def on_connection(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await handler(method, path, headers, body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Unknown')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Обрыв соединения или остановка теста посреди long polling
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(on_connection, host, 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+class LatencyModel:
+    """Задержка (нормальное распределение, обрезанное снизу нулём) и доля ошибок"""
+
+    def __init__(self, mean_ms: float, jitter_ms: float, error_rate: float, rng: random.Random):
+        self.mean = mean_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.rng = rng
+
+    async def wait(self):
+        delay = max(0.0, self.rng.gauss(self.mean, self.jitter)) if self.jitter else self.mean
+        if delay:
+            await asyncio.sleep(delay)
+
+    def fails(self) -> bool:
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+
+# === ПОДДЕЛЬНЫЙ TELEGRAM BOT API ===
+
+class FakeTelegram:
+    """Bot API: отдаёт внедрённые обновления через getUpdates и принимает исходящие вызовы"""
+
+    POLLING_METHODS = {"getMe", "getUpdates", "deleteWebhook", "setWebhook", "close", "logOut"}
+    MESSAGE_METHODS = {"sendMessage", "sendSticker", "sendDocument", "sendPhoto", "editMessageText"}
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        self.calls = Counter()
+        self.errors = 0
+        self.next_message_id = 1
+
+    def inject(self, update: dict):
+        self.pending.append(update)
+        self.wakeup.set()
+
+    @staticmethod
+    def _params(headers: dict, body: bytes) -> dict:
+        """Параметры запроса PTB: form-urlencoded со значениями в JSON (multipart не разбирается)"""
+        if "application/x-www-form-urlencoded" not in headers.get("content-type", ""):
+            return {}
+        params = {}
+        for key, values in parse_qs(body.decode("utf-8")).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+        return params
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes):
+        api_method = path.rstrip("/").rsplit("/", 1)[-1]
+        params = self._params(headers, body)
+        self.calls[api_method] += 1
+
+        if api_method == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(params)}
+        if api_method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if api_method in self.POLLING_METHODS:
+            return 200, {"ok": True, "result": True}
+
+        await self.latency.wait()
+        if self.latency.fails():
+            self.errors += 1
+            return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error: injected"}
+        if api_method == "getFile":
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: files are not supported"}
+        if api_method in self.MESSAGE_METHODS:
+            return 200, {"ok": True, "result": self._message(params)}
+        return 200, {"ok": True, "result": True}
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        self.pending = [update for update in self.pending if update["update_id"] >= offset]
+        if not self.pending:
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:int(params.get("limit") or 100)]
+
+    def _message(self, params: dict) -> dict:
+        self.next_message_id += 1
+        chat_id = params.get("chat_id") or 0
+        return {
+            "message_id": params.get("message_id") or self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text") or "",
+        }
+
+
+# === ПОДДЕЛЬНЫЙ MISTRAL API ===
+
+class FakeMistral:
+    """Chat completions: отвечает эхом последнего сообщения пользователя"""
+
+    def __init__(self, latency: LatencyModel, answer_length: int):
+        self.latency = latency
+        self.answer_length = answer_length
+        self.calls = 0
+        self.errors = 0
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes):
+        self.calls += 1
+        await self.latency.wait()
+        if self.latency.fails():
+            self.errors += 1
+            return 500, {"message": "injected error"}
+        question = json.loads(body)["messages"][-1]["content"]
+        answer = (f"Ответ на «{question}». " * self.answer_length)[:self.answer_length]
+        return 200, {"choices": [{"message": {"role": "assistant", "content": answer}}]}
+
+
+# === ПОТОКИ ОБНОВЛЕНИЙ ===
+
+class UpdateFactory:
+    """Сборка JSON-обновлений Telegram"""
+
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 10 ** 6
+
+    def _next_ids(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        update_id, message_id = self._next_ids()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        update_id, message_id = self._next_ids()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "…",
+                },
+            },
+        }
+
+
+def feedback_scenario(rng: random.Random):
+    yield "message", "📩 Обратная связь"
+    yield "callback", rng.choice(["anon_yes", "anon_no"])
+    yield "callback", str(rng.randint(1, 5))
+    yield "message", rng.choice(["Всё отлично", "Бот полезный", "Медленно отвечает", "Кул"])
+
+
+def ai_chat_scenario(rng: random.Random):
+    yield "message", "💬 Задать вопрос"
+    for _ in range(rng.randint(1, 5)):
+        yield "message", rng.choice(["Что ты умеешь?", "Расскажи о боте", "Какие контакты?", "Помощь"])
+    yield "message", "🛑 Завершить диалог"
+
+
+def knowledge_scenario(rng: random.Random):
+    yield "message", "📚 База знаний"
+    yield "callback", "kb:user:1"
+    yield "callback", "kb:find:0"
+    yield "message", rng.choice(["бот", "помощь", "контакты"])
+
+
+def admin_scenario(rng: random.Random):
+    yield "message", "/start"
+    yield "message", "👑 Админка"
+    yield "message", "📚 Управление знаниями"
+    yield "message", "📋 Просмотреть базу"
+    yield "callback", "kb:admin:1"
+    yield "message", "🔙 Назад в админку"
+    yield "message", "📊 Управление отзывами"
+    yield "message", "📊 Анализ отзывов"
+    yield "message", "🔙 Назад в админку"
+    yield "message", "📈 Статистика"
+    yield "message", "🔙 В главное меню"
+
+
+SCENARIOS = {
+    "feedback": feedback_scenario,
+    "ai": ai_chat_scenario,
+    "knowledge": knowledge_scenario,
+    "admin": admin_scenario,
+}
+
+
+def synthetic_stream(users: int, mix: dict, rng: random.Random):
+    """Бесконечный поток: каждый пользователь проходит сценарии по порядку, пользователи чередуются"""
+    factory = UpdateFactory()
+    kinds, weights = zip(*mix.items())
+    active = {}
+    while True:
+        kind = rng.choices(kinds, weights)[0]
+        user_id = main.OWNER_USER_ID if kind == "admin" else FIRST_USER_ID + rng.randrange(users)
+        steps = active.get(user_id)
+        step = next(steps, None) if steps else None
+        if step is None:
+            active[user_id] = steps = SCENARIOS[kind](rng)
+            step = next(steps)
+        step_kind, payload = step
+        yield factory.message(user_id, payload) if step_kind == "message" else factory.callback(user_id, payload)
+
+
+def recorded_stream(path: str, loop: bool):
+    """Поток из файла JSONL с обновлениями Telegram (update_id перенумеровываются)"""
+    update_id = 0
+    while True:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    update_id += 1
+                    update = json.loads(line)
+                    update["update_id"] = update_id
+                    yield update
+        if not loop:
+            return
+
+
+# === ПРОГОН ===
+
+def rss_bytes() -> int:
+    """Resident set size процесса (на Linux — текущий, иначе — пиковый)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.telegram = FakeTelegram(
+            LatencyModel(args.telegram_latency, args.telegram_jitter, args.telegram_error_rate, self.rng))
+        self.mistral = FakeMistral(
+            LatencyModel(args.mistral_latency, args.mistral_jitter, args.mistral_error_rate, self.rng),
+            args.answer_length)
+        self.injected = {}
+        self.latencies = []
+        self.handler_errors = 0
+        self.memory_samples = []
+        self.started = 0.0
+
+    async def _on_processed(self, update: Update, context):
+        injected_at = self.injected.pop(update.update_id, None)
+        if injected_at is not None:
+            self.latencies.append(time.perf_counter() - injected_at)
+
+    async def _on_error(self, update, context):
+        self.handler_errors += 1
+
+    def _configure_main(self, data_dir: str, mistral_port: int):
+        """Файлы данных бота — во временный каталог, Mistral — на локальный сервер"""
+        main.BASE_DIR = data_dir
+        main.FEEDBACK_FILE = os.path.join(data_dir, "feedback_results.txt")
+        main.EXCEL_FILE = os.path.join(data_dir, "feedback.xlsx")
+        main.KNOWLEDGE_BASE_FILE = os.path.join(data_dir, "knowledge_base.json")
+        main.MISTRAL_API_URL = f"http://127.0.0.1:{mistral_port}/v1/chat/completions"
+        main.MISTRAL_API_KEY = "loadtest"
+        main.chat_sessions.spill_dir = os.path.join(data_dir, "sessions")
+
+    def _build_app(self, telegram_port: int) -> Application:
+        builder = (
+            Application.builder()
+            .token(FAKE_TOKEN)
+            .base_url(f"http://127.0.0.1:{telegram_port}/bot")
+            .base_file_url(f"http://127.0.0.1:{telegram_port}/file/bot")
+        )
+        if not self.args.no_rate_limiter:
+            builder = builder.rate_limiter(AIORateLimiter())
+        app = main.build_application(builder)
+        app.add_handler(TypeHandler(Update, self._on_processed), group=100)
+        app.add_error_handler(self._on_error)
+        return app
+
+    def _stream(self):
+        if self.args.replay:
+            return recorded_stream(self.args.replay, self.args.loop)
+        return synthetic_stream(self.args.users, self.args.mix, self.rng)
+
+    async def _produce(self) -> int:
+        """Подача обновлений с постоянной частотой; возвращает число отправленных"""
+        interval = 1 / self.args.rate
+        sent = 0
+        for update in self._stream():
+            elapsed = time.perf_counter() - self.started
+            if (self.args.duration and elapsed >= self.args.duration) or (self.args.updates and sent >= self.args.updates):
+                break
+            delay = self.started + sent * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.injected[update["update_id"]] = time.perf_counter()
+            self.telegram.inject(update)
+            sent += 1
+        return sent
+
+    def _sample_memory(self):
+        self.memory_samples.append((
+            time.perf_counter() - self.started,
+            rss_bytes(),
+            main.chat_sessions.total_size,
+            len(self.latencies),
+        ))
+
+    async def _sample_memory_periodically(self):
+        while True:
+            self._sample_memory()
+            await asyncio.sleep(self.args.sample_interval)
+
+    async def run(self) -> dict:
+        with tempfile.TemporaryDirectory(prefix="loadtest-") as data_dir:
+            telegram_server, telegram_port = await serve_http(self.telegram.handle)
+            mistral_server, mistral_port = await serve_http(self.mistral.handle)
+            self._configure_main(data_dir, mistral_port)
+            app = self._build_app(telegram_port)
+
+            async with app:
+                await app.start()
+                await app.updater.start_polling(poll_interval=0.0, timeout=1)
+                self.started = time.perf_counter()
+                sampler = asyncio.create_task(self._sample_memory_periodically())
+
+                total = await self._produce()
+                produced_for = time.perf_counter() - self.started
+                drain_deadline = time.perf_counter() + self.args.drain_timeout
+                while self.injected and time.perf_counter() < drain_deadline:
+                    await asyncio.sleep(0.05)
+                finished_for = time.perf_counter() - self.started
+
+                sampler.cancel()
+                self._sample_memory()
+                await app.updater.stop()
+                await app.stop()
+
+            telegram_server.close()
+            mistral_server.close()
+        return self._report(total, produced_for, finished_for)
+
+    def _report(self, total: int, produced_for: float, finished_for: float) -> dict:
+        latencies_ms = np.array(self.latencies) * 1000
+        outbound = sum(count for method, count in self.telegram.calls.items()
+                       if method not in FakeTelegram.POLLING_METHODS)
+        processed = len(self.latencies)
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if processed else (0, 0, 0)
+        return {
+            "updates_sent": total,
+            "updates_processed": processed,
+            "updates_unprocessed": len(self.injected),
+            "target_rate": self.args.rate,
+            "send_seconds": round(produced_for, 3),
+            "total_seconds": round(finished_for, 3),
+            "throughput": round(processed / finished_for, 2) if finished_for else 0,
+            "latency_ms": {
+                "p50": round(float(p50), 1),
+                "p95": round(float(p95), 1),
+                "p99": round(float(p99), 1),
+                "max": round(float(latencies_ms.max()), 1) if processed else 0,
+            },
+            "errors": {
+                "handlers": self.handler_errors,
+                "telegram_injected": self.telegram.errors,
+                "mistral_injected": self.mistral.errors,
+            },
+            "telegram_calls": dict(self.telegram.calls),
+            "telegram_calls_per_update": round(outbound / processed, 2) if processed else 0,
+            "mistral_calls": self.mistral.calls,
+            "memory": [
+                {"t": round(t, 1), "rss_mb": round(rss / 2 ** 20, 1), "sessions_kb": round(sessions / 1024, 1),
+                 "processed": done}
+                for t, rss, sessions, done in self.memory_samples
+            ],
+        }
+
+
+def format_report(report: dict) -> str:
+    latency = report["latency_ms"]
+    errors = report["errors"]
+    memory = report["memory"]
+    lines = [
+        "📊 Результаты нагрузочного теста",
+        f"Обновлений: отправлено {report['updates_sent']}, обработано {report['updates_processed']}, "
+        f"не обработано {report['updates_unprocessed']}",
+        f"Время: подача {report['send_seconds']} с, всего {report['total_seconds']} с",
+        f"Пропускная способность: {report['throughput']} обн/с (цель {report['target_rate']})",
+        f"Задержка, мс: p50 {latency['p50']}, p95 {latency['p95']}, p99 {latency['p99']}, max {latency['max']}",
+        f"Ошибки: обработчики {errors['handlers']}, Telegram {errors['telegram_injected']}, "
+        f"Mistral {errors['mistral_injected']}",
+        f"Вызовов Bot API на обновление: {report['telegram_calls_per_update']}",
+        "  " + ", ".join(f"{method}: {count}" for method, count in sorted(report["telegram_calls"].items())),
+        f"Вызовов Mistral: {report['mistral_calls']}",
+    ]
+    if memory:
+        lines.append(f"Память (RSS): {memory[0]['rss_mb']} → {memory[-1]['rss_mb']} МБ "
+                     f"({memory[-1]['rss_mb'] - memory[0]['rss_mb']:+.1f}), сессии {memory[-1]['sessions_kb']} КБ")
+        for sample in memory:
+            lines.append(f"  t={sample['t']:>7} с  RSS {sample['rss_mb']:>7} МБ  "
+                         f"сессии {sample['sessions_kb']:>8} КБ  обработано {sample['processed']}")
+    return "\n".join(lines)
+
+
+def parse_mix(value: str) -> dict:
+    """Доли сценариев: «ai=3,feedback=1,knowledge=1,admin=0.2»"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий «{name}», доступны: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с поддельными Telegram и Mistral")
+    parser.add_argument("--rate", type=float, default=10, help="обновлений в секунду")
+    parser.add_argument("--duration", type=float, default=0, help="длительность подачи, с (0 — без ограничения)")
+    parser.add_argument("--updates", type=int, default=0, help="число обновлений (0 — без ограничения)")
+    parser.add_argument("--users", type=int, default=100, help="число синтетических пользователей")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("ai=3,feedback=1,knowledge=1,admin=0.2"),
+                        help="доли сценариев, например ai=3,feedback=1,knowledge=1,admin=0.2")
+    parser.add_argument("--replay", help="файл JSONL с записанными обновлениями Telegram")
+    parser.add_argument("--loop", action="store_true", help="повторять записанный поток по кругу")
+    parser.add_argument("--telegram-latency", type=float, default=20, help="средняя задержка Bot API, мс")
+    parser.add_argument("--telegram-jitter", type=float, default=10, help="разброс задержки Bot API, мс")
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0, help="доля ошибок Bot API (0..1)")
+    parser.add_argument("--mistral-latency", type=float, default=300, help="средняя задержка Mistral, мс")
+    parser.add_argument("--mistral-jitter", type=float, default=100, help="разброс задержки Mistral, мс")
+    parser.add_argument("--mistral-error-rate", type=float, default=0.0, help="доля ошибок Mistral (0..1)")
+    parser.add_argument("--answer-length", type=int, default=400, help="длина ответа Mistral, символов")
+    parser.add_argument("--no-rate-limiter", action="store_true", help="запуск без AIORateLimiter")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="ожидание обработки после подачи, с")
+    parser.add_argument("--sample-interval", type=float, default=5, help="интервал замера памяти, с")
+    parser.add_argument("--seed", type=int, default=0, help="зерно генератора случайных чисел")
+    parser.add_argument("--json", help="сохранить отчёт в JSON-файл")
+    args = parser.parse_args(argv)
+    if not args.duration and not args.updates and not (args.replay and not args.loop):
+        parser.error("укажите --duration или --updates")
+    return args
+
+
+def run(argv=None) -> dict:
+    args = parse_args(argv)
+    report = asyncio.run(LoadTest(args).run())
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    run()
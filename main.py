@@ -1,15 +1,25 @@
 import os
+import io
+import re
+import csv
+import sys
+import time
+import hashlib
+import asyncio
 import pandas as pd
+import numpy as np
+from collections import Counter, OrderedDict
 from datetime import datetime
 import httpx
 import json
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     filters,
     ContextTypes,
+    AIORateLimiter,
     ConversationHandler,
     CallbackQueryHandler,
 )
@@ -25,8 +35,6 @@ load_dotenv()
 
 # Получаем токен из переменных окружения
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-if not TOKEN:
-    raise ValueError("Не указан TELEGRAM_BOT_TOKEN в переменных окружения!")
 MISTRAL_API_KEY = ""
 BASE_DIR = r"C:\telerambot"
 FEEDBACK_FILE = os.path.join(BASE_DIR, "feedback_results.txt")
@@ -42,15 +50,30 @@ ADMIN_MENU = "admin_menu"
 ADMIN_KNOWLEDGE = "admin_knowledge"
 ADMIN_FEEDBACK = "admin_feedback"
 
+# Надписи кнопок reply-клавиатур: такие сообщения — команды меню, а не ввод текста
+MENU_BUTTONS = {
+    "💬 Задать вопрос", "📩 Обратная связь", "📚 База знаний", "📊 Статистика", "📥 Скачать Excel",
+    "🔄 Перезапустить", "🛑 Завершить диалог", "👑 Админка",
+    "📚 Управление знаниями", "📊 Управление отзывами", "📈 Статистика", "⚙️ Настройки", "🔙 В главное меню",
+    "➕ Добавить знание", "📋 Просмотреть базу", "✏️ Редактировать знание", "🗑️ Удалить знание",
+    "📤 Импорт базы", "📥 Экспорт базы", "🔙 Назад в админку",
+    "📥 Скачать отзывы", "📊 Анализ отзывов", "📧 Отправить уведомление", "🗑️ Очистить отзывы",
+}
+
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===
 
-def load_knowledge_base():
-    """Загрузка базы знаний из файла"""
+def load_knowledge_base(strict: bool = False):
+    """Загрузка базы знаний из файла (strict — ошибка чтения вызывает ValueError, а не пустую базу)"""
     if os.path.exists(KNOWLEDGE_BASE_FILE):
         try:
             with open(KNOWLEDGE_BASE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                knowledge_base = json.load(f)
+            if strict and not isinstance(knowledge_base, dict):
+                raise ValueError("ожидается объект {ключ: значение}")
+            return knowledge_base
         except Exception as e:
+            if strict:
+                raise ValueError(f"текущий файл базы знаний не прочитан: {e}") from e
             print(f"[Knowledge Base Load Error] {e}")
             return {}
     else:
@@ -65,14 +88,19 @@ def load_knowledge_base():
         return default_knowledge
 
 
-def save_knowledge_base(knowledge_base):
-    """Сохранение базы знаний в файл"""
+def save_knowledge_base(knowledge_base) -> bool:
+    """Сохранение базы знаний в файл (через временный файл, чтобы не оставить его недописанным)"""
     os.makedirs(BASE_DIR, exist_ok=True)
+    _knowledge_cache.clear()
+    tmp_file = KNOWLEDGE_BASE_FILE + ".tmp"
     try:
-        with open(KNOWLEDGE_BASE_FILE, 'w', encoding='utf-8') as f:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(knowledge_base, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, KNOWLEDGE_BASE_FILE)
+        return True
     except Exception as e:
         print(f"[Knowledge Base Save Error] {e}")
+        return False
 
 
 def search_knowledge_base(query: str, knowledge_base: dict) -> str:
@@ -87,23 +115,679 @@ def search_knowledge_base(query: str, knowledge_base: dict) -> str:
     return "\n".join(relevant_info) if relevant_info else ""
 
 
+# === ИМПОРТ И ЭКСПОРТ БАЗЫ ЗНАНИЙ ===
+
+KNOWLEDGE_FORMATS = ("json", "jsonl", "csv")
+MAX_KNOWLEDGE_KEY_LENGTH = 256
+MAX_IMPORT_ERRORS = 10
+
+
+def knowledge_format(filename: str) -> str:
+    """Формат файла базы знаний по расширению"""
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension not in KNOWLEDGE_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат «{extension}». Допустимы: {', '.join(KNOWLEDGE_FORMATS)}")
+    return extension
+
+
+def _knowledge_record(record) -> tuple:
+    """Пара (ключ, значение) из записи {"key": ..., "value": ...} или {ключ: значение}"""
+    if isinstance(record, dict) and set(record) == {"key", "value"}:
+        return record["key"], record["value"]
+    if isinstance(record, dict) and len(record) == 1:
+        return next(iter(record.items()))
+    if isinstance(record, (list, tuple)) and len(record) == 2:
+        return record[0], record[1]
+    raise ValueError("ожидается пара ключ/значение")
+
+
+def iter_knowledge_records(stream, fmt: str):
+    """Потоковое чтение записей: выдаёт (номер строки, запись)"""
+    if fmt == "json":
+        # Для JSON построчный разбор невозможен, документ читается целиком
+        data = json.load(stream)
+        if not isinstance(data, (dict, list)):
+            raise ValueError("ожидается объект {ключ: значение} или список записей")
+        items = data.items() if isinstance(data, dict) else data
+        for number, record in enumerate(items, 1):
+            yield number, record
+    elif fmt == "jsonl":
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"строка {number}: {e}")
+    else:
+        reader = csv.reader(stream)
+        for row in reader:
+            if reader.line_num == 1 and [cell.strip().lower() for cell in row] in (["key", "value"], ["ключ", "значение"]):
+                continue
+            if row:
+                yield reader.line_num, row
+
+
+def read_knowledge_import(stream, fmt: str) -> dict:
+    """Чтение и проверка файла импорта; при любой ошибке не возвращает ничего частично"""
+    records = {}
+    errors = []
+    try:
+        for number, record in iter_knowledge_records(stream, fmt):
+            try:
+                key, value = _knowledge_record(record)
+                if not isinstance(key, str):
+                    raise ValueError("ключ должен быть строкой")
+                if not isinstance(value, str):
+                    raise ValueError("значение должно быть строкой")
+                key, value = key.strip(), value.strip()
+                if not key:
+                    raise ValueError("пустой ключ")
+                if len(key) > MAX_KNOWLEDGE_KEY_LENGTH:
+                    raise ValueError(f"ключ длиннее {MAX_KNOWLEDGE_KEY_LENGTH} символов")
+                if not value:
+                    raise ValueError("пустое значение")
+                records[key] = value
+            except ValueError as e:
+                errors.append(f"запись {number}: {e}")
+                if len(errors) >= MAX_IMPORT_ERRORS:
+                    break
+    except (ValueError, csv.Error) as e:
+        errors.append(f"файл не разобран: {e}")
+    if errors:
+        raise ValueError("\n".join(errors))
+    return records
+
+
+def apply_knowledge_batch(records: dict) -> dict:
+    """Применение пакета записей: одна запись файла и одно обновление кэша"""
+    # Пустая база вместо нечитаемого файла затёрла бы при сохранении все записи
+    knowledge_base = load_knowledge_base(strict=True)
+    added = sum(1 for key in records if key not in knowledge_base)
+    knowledge_base.update(records)
+    if not save_knowledge_base(knowledge_base):
+        raise OSError("не удалось сохранить базу знаний")
+    update_knowledge_cache(knowledge_base)
+    return {"added": added, "updated": len(records) - added, "total": len(knowledge_base)}
+
+
+def write_knowledge_export(knowledge_base: dict, stream, fmt: str):
+    """Потоковая запись базы знаний в выбранном формате"""
+    if fmt == "json":
+        json.dump(knowledge_base, stream, ensure_ascii=False, indent=2)
+    elif fmt == "jsonl":
+        for key, value in knowledge_base.items():
+            stream.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+    else:
+        writer = csv.writer(stream)
+        writer.writerow(["key", "value"])
+        writer.writerows(knowledge_base.items())
+
+
+def run_knowledge_cli(command: str, path: str):
+    """Импорт/экспорт базы знаний из командной строки"""
+    try:
+        fmt = knowledge_format(path)
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+    if command == "import-kb":
+        try:
+            with open(path, "r", encoding="utf-8-sig", newline="") as f:
+                result = apply_knowledge_batch(read_knowledge_import(f, fmt))
+        except (ValueError, OSError) as e:
+            sys.exit(f"❌ Импорт отменён, база знаний не изменена:\n{e}")
+        print(f"✅ Импорт завершён: новых {result['added']}, обновлено {result['updated']}, всего {result['total']}")
+    else:
+        try:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                write_knowledge_export(load_knowledge_base(), f, fmt)
+        except OSError as e:
+            sys.exit(f"❌ Ошибка при выгрузке: {e}")
+        print(f"✅ База знаний выгружена в {path}")
+
+
+# === АНАЛИТИКА ОТЗЫВОВ ===
+
+FEEDBACK_WINDOWS = [("24 часа", 1), ("7 дней", 7), ("30 дней", 30)]
+SPAM_INTERVAL_SECONDS = 60
+TOP_USERS_LIMIT = 5
+TOP_TERMS_LIMIT = 10
+TERM_PATTERN = re.compile(r"[\w-]{3,}")
+TERM_SEPARATOR = "SEP"
+
+# Кэш: путь к файлу -> {"signature", "data", "hour", "result"}
+_feedback_analytics_cache = {}
+
+
+def count_feedback_terms(comments, counts) -> Counter:
+    """Частота слов: каждое слово учитывается один раз на отзыв"""
+    # Один проход регулярного выражения по всем комментариям, разделённым маркером
+    # в верхнем регистре (в приведённом к нижнему регистру тексте он встретиться не может)
+    text = f"\0{TERM_SEPARATOR}\0".join(comment.lower() for comment in comments)
+    tokens = np.array(TERM_PATTERN.findall(text), dtype=object)
+    is_separator = tokens == TERM_SEPARATOR
+    if is_separator.all():
+        return Counter()
+    comment_of_token = np.cumsum(is_separator)[~is_separator]
+    term_codes, terms = pd.factorize(tokens[~is_separator])
+    # Пары (комментарий, слово) без повторов внутри комментария, затем вес = число таких отзывов
+    pairs = np.sort(comment_of_token * len(terms) + term_codes)
+    pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+    weights = np.bincount(pairs % len(terms), weights=np.asarray(counts)[pairs // len(terms)], minlength=len(terms))
+    used = weights > 0
+    return Counter(dict(zip(terms[used], weights[used].astype(np.int64).tolist())))
+
+
+def load_feedback_arrays(file_path: str) -> dict:
+    """Загрузка отзывов в колоночные NumPy-массивы"""
+    df = pd.read_excel(file_path)
+    n = len(df)
+
+    def column(name, default):
+        return df[name] if name in df.columns else pd.Series([default] * n)
+
+    timestamps = pd.to_datetime(column("Дата и время", None), errors="coerce")
+    ratings = pd.to_numeric(column("Оценка", 0), errors="coerce").fillna(0)
+    # Коды в порядке появления, чтобы новые значения дописывались в конец без перекодирования
+    user_codes, users = pd.factorize(column("Пользователь", "").astype(str))
+    comment_codes, comments = pd.factorize(column("Комментарий", "").fillna("").astype(str))
+    users, comments = list(users), list(comments)
+
+    return {
+        # Секунды от эпохи; -1 для нераспознанных дат
+        "timestamps": np.where(timestamps.isna(), -1, timestamps.to_numpy(dtype="datetime64[s]").astype(np.int64)),
+        "ratings": ratings.to_numpy().clip(0, 5).astype(np.int8),
+        "anonymous": (column("Анонимный", "Нет").to_numpy() == "Да"),
+        "users": users,
+        "user_index": {user: code for code, user in enumerate(users)},
+        "user_codes": user_codes.astype(np.int64),
+        "comments": comments,
+        "comment_index": {comment: code for code, comment in enumerate(comments)},
+        "comment_codes": comment_codes.astype(np.int64),
+        "term_counts": count_feedback_terms(comments, np.bincount(comment_codes, minlength=len(comments))),
+        # Список частых слов, None — пересчитать
+        "top_terms": None,
+    }
+
+
+def append_feedback_arrays(data: dict, row: dict):
+    """Дописывание одного отзыва в загруженные массивы без повторного чтения файла"""
+    def code(values, index, value):
+        if value not in index:
+            index[value] = len(values)
+            values.append(value)
+        return index[value]
+
+    timestamp = pd.to_datetime(row["Дата и время"], errors="coerce")
+    comment = str(row["Комментарий"] or "")
+    data["timestamps"] = np.append(data["timestamps"], -1 if pd.isna(timestamp) else int(timestamp.timestamp()))
+    data["ratings"] = np.append(data["ratings"], np.int8(min(max(int(row["Оценка"]), 0), 5)))
+    data["anonymous"] = np.append(data["anonymous"], row["Анонимный"] == "Да")
+    data["user_codes"] = np.append(data["user_codes"], code(data["users"], data["user_index"], str(row["Пользователь"])))
+    data["comment_codes"] = np.append(data["comment_codes"], code(data["comments"], data["comment_index"], comment))
+    # Порядок первого появления, как при загрузке: от него зависит порядок слов с равной частотой
+    terms = list(dict.fromkeys(TERM_PATTERN.findall(comment.lower())))
+    data["term_counts"].update(terms)
+    # Список частых слов сбрасывается, только если новое слово может в него попасть
+    top_terms = data["top_terms"]
+    if top_terms is not None and terms:
+        threshold = top_terms[-1][1] if len(top_terms) == TOP_TERMS_LIMIT else 0
+        if any(data["term_counts"][term] >= threshold for term in terms):
+            data["top_terms"] = None
+
+
+def cache_new_feedback(file_path: str, row: dict, total: int):
+    """Обновление кэша аналитики после записи отзыва в файл (total — строк в файле вместе с новой)"""
+    cached = _feedback_analytics_cache.get(file_path)
+    if not cached:
+        return
+    if len(cached["data"]["ratings"]) != total - 1:
+        # Кэш не соответствует файлу — при следующем анализе файл будет прочитан заново
+        del _feedback_analytics_cache[file_path]
+        return
+    append_feedback_arrays(cached["data"], row)
+    stat = os.stat(file_path)
+    cached["signature"] = (stat.st_mtime_ns, stat.st_size)
+    cached["hour"] = None
+
+
+def analyze_feedback_arrays(data: dict, now: datetime = None) -> dict:
+    """Векторизованный анализ отзывов"""
+    timestamps = data["timestamps"]
+    ratings = data["ratings"]
+    user_codes = data["user_codes"]
+    comment_codes = data["comment_codes"]
+    total = len(ratings)
+    now_ts = np.datetime64(now or datetime.now(), "s").astype(np.int64)
+
+    rated = ratings > 0
+    stats = {
+        "total": total,
+        "avg_rating": float(ratings[rated].mean()) if rated.any() else 0.0,
+        "anonymous": int(data["anonymous"].sum()),
+        "distribution": np.bincount(ratings, minlength=6)[1:6],
+    }
+
+    # Распределение оценок по временным окнам
+    stats["windows"] = []
+    for title, days in FEEDBACK_WINDOWS:
+        mask = timestamps >= now_ts - days * 86400
+        window_ratings = ratings[mask & rated]
+        stats["windows"].append({
+            "title": title,
+            "count": int(mask.sum()),
+            "avg_rating": float(window_ratings.mean()) if len(window_ratings) else 0.0,
+            "distribution": np.bincount(window_ratings, minlength=6)[1:6],
+        })
+
+    # Частота отправки по пользователям (отзывов в день за период активности)
+    user_counts = np.bincount(user_codes, minlength=len(data["users"]))
+    dated = timestamps >= 0
+    first_seen = np.full(len(data["users"]), np.iinfo(np.int64).max)
+    last_seen = np.full(len(data["users"]), -1, dtype=np.int64)
+    np.minimum.at(first_seen, user_codes[dated], timestamps[dated])
+    np.maximum.at(last_seen, user_codes[dated], timestamps[dated])
+    active_days = np.maximum((last_seen - first_seen) / 86400, 1.0)
+    user_rates = np.where(last_seen >= 0, user_counts / active_days, user_counts)
+    top_users = np.argsort(-user_counts, kind="stable")[:TOP_USERS_LIMIT]
+    stats["unique_users"] = len(data["users"])
+    stats["top_users"] = [
+        (str(data["users"][i]), int(user_counts[i]), float(user_rates[i]))
+        for i in top_users if user_counts[i] > 0
+    ]
+
+    # Дубликаты: одинаковый комментарий от одного и того же пользователя
+    pair_keys = user_codes * max(len(data["comments"]), 1) + comment_codes
+    _, pair_counts = np.unique(pair_keys, return_counts=True)
+    stats["duplicates"] = int((pair_counts - 1).sum())
+
+    # Спам: отзывы одного пользователя чаще, чем раз в SPAM_INTERVAL_SECONDS.
+    # Сортировка одного составного ключа (пользователь, время) быстрее lexsort
+    dated_times = timestamps[dated]
+    start = dated_times.min() if len(dated_times) else 0
+    span = int(dated_times.max() - start) + 1 if len(dated_times) else 1
+    keys = np.sort(user_codes[dated] * span + (dated_times - start))
+    sorted_users, sorted_times = np.divmod(keys, span)
+    burst = (sorted_users[1:] == sorted_users[:-1]) & (np.diff(sorted_times) < SPAM_INTERVAL_SECONDS)
+    stats["spam"] = int(burst.sum())
+    spam_users = np.unique(sorted_users[1:][burst])
+    stats["spam_users"] = [str(data["users"][i]) for i in spam_users[:TOP_USERS_LIMIT]]
+
+    # Частые слова считаются при загрузке и дописываются по одному отзыву
+    if data["top_terms"] is None:
+        data["top_terms"] = data["term_counts"].most_common(TOP_TERMS_LIMIT)
+    stats["top_terms"] = data["top_terms"]
+
+    return stats
+
+
+def format_feedback_report(stats: dict) -> str:
+    """Текстовый отчёт по результатам анализа отзывов"""
+    total = stats["total"]
+    response = "📈 Аналитика отзывов:\n\n"
+    response += f"📊 Всего отзывов: {total}\n"
+    response += f"⭐ Средняя оценка: {stats['avg_rating']:.1f}\n"
+    response += f"👤 Анонимных отзывов: {stats['anonymous']}\n"
+    response += f"📝 Публичных отзывов: {total - stats['anonymous']}\n"
+    response += f"👥 Уникальных пользователей: {stats['unique_users']}\n\n"
+
+    response += "⭐ Распределение оценок:\n"
+    for rating, count in zip(range(5, 0, -1), stats["distribution"][::-1]):
+        share = count / total * 100 if total else 0
+        response += f"{rating} ⭐️: {count} ({share:.0f}%)\n"
+
+    response += "\n🕒 По периодам:\n"
+    for window in stats["windows"]:
+        response += f"• {window['title']}: {window['count']} отзывов, средняя {window['avg_rating']:.1f}\n"
+
+    if stats["top_users"]:
+        response += "\n🏆 Самые активные:\n"
+        for user, count, rate in stats["top_users"]:
+            response += f"• {user}: {count} ({rate:.1f} в день)\n"
+
+    response += f"\n♻️ Дубликатов: {stats['duplicates']}\n"
+    response += f"🚫 Подозрение на спам: {stats['spam']}"
+    if stats["spam_users"]:
+        response += f" ({', '.join(stats['spam_users'])})"
+    response += "\n"
+
+    if stats["top_terms"]:
+        response += "\n🔤 Частые слова: "
+        response += ", ".join(f"{term} ({count})" for term, count in stats["top_terms"])
+
+    return response
+
+
+def render_feedback_report(stats: dict) -> bytes:
+    """Сводный Excel-файл по результатам анализа отзывов"""
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        pd.DataFrame([
+            ("Всего отзывов", stats["total"]),
+            ("Средняя оценка", round(stats["avg_rating"], 2)),
+            ("Анонимных отзывов", stats["anonymous"]),
+            ("Уникальных пользователей", stats["unique_users"]),
+            ("Дубликатов", stats["duplicates"]),
+            ("Подозрение на спам", stats["spam"]),
+        ], columns=["Показатель", "Значение"]).to_excel(writer, sheet_name="Сводка", index=False)
+
+        rows = [["Все время", stats["total"], round(stats["avg_rating"], 2), *stats["distribution"]]]
+        for window in stats["windows"]:
+            rows.append([window["title"], window["count"], round(window["avg_rating"], 2), *window["distribution"]])
+        pd.DataFrame(
+            rows, columns=["Период", "Отзывов", "Средняя", "1 ⭐", "2 ⭐", "3 ⭐", "4 ⭐", "5 ⭐"]
+        ).to_excel(writer, sheet_name="Оценки", index=False)
+
+        pd.DataFrame(
+            stats["top_users"], columns=["Пользователь", "Отзывов", "В день"]
+        ).to_excel(writer, sheet_name="Пользователи", index=False)
+        pd.DataFrame(
+            stats["top_terms"], columns=["Слово", "Упоминаний"]
+        ).to_excel(writer, sheet_name="Слова", index=False)
+    return buffer.getvalue()
+
+
+async def get_feedback_analytics(file_path: str) -> dict:
+    """Анализ отзывов с кэшированием по времени изменения и размеру файла"""
+    stat = os.stat(file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    now = datetime.now()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    cached = _feedback_analytics_cache.get(file_path)
+
+    if cached and cached["signature"] == signature:
+        # Данные не менялись: отчёт пересчитывается только раз в час из-за временных окон
+        if cached["hour"] == hour:
+            return cached["result"]
+        data = cached["data"]
+    else:
+        # Чтение Excel и подсчёт слов на больших файлах занимают секунды — в отдельном потоке,
+        # чтобы не блокировать обработку сообщений остальных пользователей
+        data = await asyncio.to_thread(load_feedback_arrays, file_path)
+
+    stats = analyze_feedback_arrays(data, now)
+    result = {
+        "text": format_feedback_report(stats),
+        "file": render_feedback_report(stats),
+    }
+    _feedback_analytics_cache[file_path] = {"signature": signature, "data": data, "hour": hour, "result": result}
+    return result
+
+
+# === ИСХОДЯЩИЕ СООБЩЕНИЯ ===
+
+OUTBOUND_CACHE_SIZE = 1000
+
+# Хэши содержимого сообщений: (chat_id, message_id) -> hash(текст, клавиатура)
+_message_hashes = OrderedDict()
+# Callback query, на которые уже отправлен answer()
+_answered_queries = OrderedDict()
+
+
+def _remember(cache: OrderedDict, key, value, size: int = OUTBOUND_CACHE_SIZE):
+    """Запись в ограниченный по размеру LRU-кэш"""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > size:
+        cache.popitem(last=False)
+
+
+def content_hash(text: str, reply_markup=None) -> int:
+    """Хэш содержимого сообщения (клавиатуры telegram хэшируемы)"""
+    return hash((text.strip(), reply_markup))
+
+
+async def answer_query(query, text: str = None):
+    """Однократный ответ на callback query"""
+    if query.id in _answered_queries:
+        return
+    _remember(_answered_queries, query.id, True)
+    try:
+        await query.answer(text)
+    except Exception as e:
+        print(f"[answer_query] Ошибка: {e}")
+
+
 async def safe_edit_message(query, text, reply_markup=None):
+    """Редактирование сообщения без повторной отправки того же содержимого"""
+    message = query.message
+    key = (message.chat_id, message.message_id) if message else query.inline_message_id
+    new_hash = content_hash(text, reply_markup)
+    old_hash = _message_hashes.get(key)
+    if old_hash is None and message:
+        old_hash = content_hash(message.text or "", message.reply_markup)
+
+    if old_hash == new_hash:
+        return await answer_query(query)
     try:
-        current_text = query.message.text if query.message and query.message.text else ""
-        current_markup = query.message.reply_markup if query.message else None
-        
-        if current_text.strip() == text.strip():
-            if reply_markup:
-                new_markup_str = str(reply_markup.inline_keyboard)
-                old_markup_str = str(current_markup.inline_keyboard) if current_markup else ""
-                if old_markup_str == new_markup_str:
-                    return await query.answer()
-            elif current_markup is None:
-                return await query.answer()
-        return await query.edit_message_text(text=text, reply_markup=reply_markup)
+        # Ответ на callback и редактирование уходят параллельно
+        await asyncio.gather(
+            query.edit_message_text(text=text, reply_markup=reply_markup),
+            answer_query(query)
+        )
+        _remember(_message_hashes, key, new_hash)
     except Exception as e:
         print(f"[safe_edit_message] Ошибка: {e}")
-        await query.answer()
+        await answer_query(query)
+
+
+# === СЕССИИ ДИАЛОГА С ИИ ===
+
+SESSION_IDLE_TTL = 30 * 60  # секунд без сообщений до удаления сессии
+SESSION_MEMORY_BUDGET = 50 * 1024 * 1024  # байт на все сессии в памяти
+SESSION_SPILL_DIR = os.path.join(BASE_DIR, "sessions")  # None — не выгружать сессии на диск
+
+
+class ChatTurn:
+    """Одна реплика диалога"""
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        # Роли интернированы: все реплики ссылаются на две общие строки
+        self.role = sys.intern(role)
+        self.content = content
+
+    def size(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.content)
+
+
+class ChatSession:
+    """История диалога одного пользователя"""
+    __slots__ = ("turns", "last_active", "size")
+
+    def __init__(self, turns: list = None):
+        self.turns = turns or []
+        self.last_active = time.monotonic()
+        self.size = sys.getsizeof(self) + sum(self.turn_size(turn) for turn in self.turns)
+
+    @staticmethod
+    def turn_size(turn: ChatTurn) -> int:
+        """Память реплики вместе с указателем на неё в списке"""
+        return turn.size() + 8
+
+    def append(self, role: str, content: str) -> int:
+        """Добавление реплики; возвращает прирост занимаемой памяти"""
+        turn = ChatTurn(role, content)
+        self.turns.append(turn)
+        self.last_active = time.monotonic()
+        grown = self.turn_size(turn)
+        self.size += grown
+        return grown
+
+    def messages(self) -> list:
+        """История в формате сообщений Mistral API"""
+        return [{"role": turn.role, "content": turn.content} for turn in self.turns]
+
+
+class SessionManager:
+    """Хранилище диалогов с ограничением памяти, истечением по простою и выгрузкой на диск"""
+
+    def __init__(self, memory_budget: int, idle_ttl: float, spill_dir: str = None):
+        self.memory_budget = memory_budget
+        self.idle_ttl = idle_ttl
+        self.spill_dir = spill_dir
+        # user_id -> ChatSession, от давно неактивных к недавним
+        self._sessions = OrderedDict()
+        # user_id -> last_active сессий, выгруженных на диск, в порядке выгрузки
+        self._spilled = OrderedDict()
+        self.total_size = 0
+
+    def _spill_path(self, user_id: int) -> str:
+        return os.path.join(self.spill_dir, f"{user_id}.json")
+
+    def _remove(self, user_id: int):
+        session = self._sessions.pop(user_id, None)
+        if session:
+            self.total_size -= session.size
+        if self._spilled.pop(user_id, None) is not None:
+            try:
+                os.remove(self._spill_path(user_id))
+            except OSError as e:
+                print(f"[Session Spill Error] {e}")
+
+    def _spill(self, user_id: int):
+        """Выгрузка сессии на диск (или удаление, если выгрузка отключена)"""
+        session = self._sessions.pop(user_id)
+        self.total_size -= session.size
+        if not self.spill_dir:
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(user_id), "w", encoding="utf-8") as f:
+                json.dump([[turn.role, turn.content] for turn in session.turns], f, ensure_ascii=False)
+            self._spilled[user_id] = session.last_active
+        except Exception as e:
+            print(f"[Session Spill Error] {e}")
+
+    def _restore(self, user_id: int):
+        """Загрузка выгруженной сессии обратно в память"""
+        self._spilled.pop(user_id)
+        try:
+            with open(self._spill_path(user_id), "r", encoding="utf-8") as f:
+                turns = [ChatTurn(role, content) for role, content in json.load(f)]
+            os.remove(self._spill_path(user_id))
+        except Exception as e:
+            print(f"[Session Restore Error] {e}")
+            return None
+        # Сессия восстанавливается по обращению пользователя — это и есть новая активность
+        session = ChatSession(turns)
+        self._store(user_id, session)
+        return session
+
+    def _store(self, user_id: int, session: ChatSession):
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        self.total_size += session.size
+        self._enforce_budget(keep=user_id)
+
+    def _enforce_budget(self, keep: int = None):
+        """Выгрузка самых давно активных сессий, пока не уложимся в бюджет"""
+        while self.total_size > self.memory_budget and len(self._sessions) > 1:
+            user_id = next(iter(self._sessions))
+            if user_id == keep:
+                break
+            self._spill(user_id)
+
+    def evict_idle(self):
+        """Удаление сессий, простаивающих дольше idle_ttl.
+
+        Сессии в _sessions упорядочены по last_active: при каждом обращении
+        last_active обновляется и сессия переносится в конец, поэтому
+        перебор останавливается на первой свежей сессии. На диск сессии
+        выгружаются с начала _sessions, так что _spilled упорядочен так же.
+        """
+        deadline = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_active >= deadline:
+                break
+            self._remove(user_id)
+        while self._spilled:
+            user_id, last_active = next(iter(self._spilled.items()))
+            if last_active >= deadline:
+                break
+            self._remove(user_id)
+
+    def start(self, user_id: int) -> ChatSession:
+        """Новая пустая сессия вместо прежней"""
+        self.evict_idle()
+        self._remove(user_id)
+        session = ChatSession()
+        self._store(user_id, session)
+        return session
+
+    def get(self, user_id: int) -> ChatSession:
+        """Сессия пользователя или None, если её нет или она истекла"""
+        self.evict_idle()
+        if user_id in self._sessions:
+            session = self._sessions[user_id]
+            session.last_active = time.monotonic()
+            self._sessions.move_to_end(user_id)
+            return session
+        if user_id in self._spilled:
+            return self._restore(user_id)
+        return None
+
+    def append(self, user_id: int, role: str, content: str):
+        """Добавление реплики в сессию пользователя"""
+        session = self.get(user_id) or self.start(user_id)
+        self.total_size += session.append(role, content)
+        self._sessions.move_to_end(user_id)
+        self._enforce_budget(keep=user_id)
+
+    def end(self, user_id: int):
+        """Завершение сессии пользователя"""
+        self._remove(user_id)
+
+    def clear_spilled(self):
+        """Удаление выгруженных сессий, оставшихся от прошлого запуска"""
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return
+        for name in os.listdir(self.spill_dir):
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(self.spill_dir, name))
+                except OSError as e:
+                    print(f"[Session Spill Error] {e}")
+
+    def memory_usage(self) -> dict:
+        """Память сессий: всего и по каждой сессии в памяти"""
+        return {
+            "total": self.total_size,
+            "budget": self.memory_budget,
+            "in_memory": len(self._sessions),
+            "spilled": len(self._spilled),
+            "sessions": {user_id: session.size for user_id, session in self._sessions.items()},
+        }
+
+
+chat_sessions = SessionManager(SESSION_MEMORY_BUDGET, SESSION_IDLE_TTL, SESSION_SPILL_DIR)
+
+
+def build_stats_text() -> str:
+    """Текст статистики бота"""
+    stats_text = "📈 Статистика бота:\n\n"
+    stats_text += "📊 Отзывы: "
+    if os.path.exists(EXCEL_FILE):
+        try:
+            df = pd.read_excel(EXCEL_FILE)
+            stats_text += f"{len(df)} записей\n"
+        except:
+            stats_text += "ошибка чтения\n"
+    else:
+        stats_text += "нет данных\n"
+    
+    stats_text += "📚 База знаний: "
+    knowledge_base = load_knowledge_base()
+    stats_text += f"{len(knowledge_base)} записей\n"
+    
+    chat_sessions.evict_idle()
+    usage = chat_sessions.memory_usage()
+    stats_text += f"💬 Диалоги с ИИ: {usage['in_memory']} в памяти, {usage['spilled']} на диске\n"
+    stats_text += f"🧠 Память диалогов: {usage['total'] / 1024:.1f} из {usage['budget'] / 1024:.0f} КБ\n"
+    largest = sorted(usage["sessions"].items(), key=lambda item: item[1], reverse=True)[:5]
+    for user_id, size in largest:
+        stats_text += f"  • {user_id}: {size / 1024:.1f} КБ\n"
+    return stats_text
 
 
 async def call_mistral_api(prompt: str, chat_history: list = None, knowledge_context: str = "") -> str:
@@ -138,8 +822,9 @@ async def call_mistral_api(prompt: str, chat_history: list = None, knowledge_con
         return "⚠️ Извините, не могу сейчас ответить. Попробуйте позже."
 
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, is_owner=False):
-    """Показ главного меню"""
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, is_owner=False,
+                         text: str = "👇 Выберите действие:"):
+    """Показ главного меню (текст сообщения и клавиатура отправляются одним запросом)"""
     if is_owner:
         keyboard = [
             ["💬 Задать вопрос", "📩 Обратная связь"],
@@ -156,9 +841,9 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, is_
     
     # Проверяем тип update
     if hasattr(update, 'message') and update.message:
-        await update.message.reply_text("👇 Выберите действие:", reply_markup=reply_markup)
+        await update.message.reply_text(text, reply_markup=reply_markup)
     elif hasattr(update, 'callback_query') and update.callback_query:
-        await update.callback_query.message.reply_text("👇 Выберите действие:", reply_markup=reply_markup)
+        await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
 
 
 async def show_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -183,6 +868,7 @@ async def show_knowledge_admin_menu(update: Update, context: ContextTypes.DEFAUL
     keyboard = [
         ["➕ Добавить знание", "📋 Просмотреть базу"],
         ["✏️ Редактировать знание", "🗑️ Удалить знание"],
+        ["📤 Импорт базы", "📥 Экспорт базы"],
         ["🔙 Назад в админку"]
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
@@ -214,6 +900,176 @@ async def show_feedback_admin_menu(update: Update, context: ContextTypes.DEFAULT
 
 # === УПРАВЛЕНИЕ БАЗОЙ ЗНАНИЙ ===
 
+KNOWLEDGE_PAGE_SIZE = 10
+MAX_MESSAGE_LENGTH = 4096
+KNOWLEDGE_SEARCH_TTL = 5 * 60  # секунд ожидания текста после нажатия «🔍 Поиск»
+KNOWLEDGE_SEARCH_CACHE_SIZE = 32
+SEARCH_QUERY_PREVIEW = 50
+KNOWLEDGE_HEADERS = {
+    "user": "📚 Информация из базы знаний:\n\n",
+    "admin": "📚 Текущая база знаний:\n\n",
+}
+
+# Кэш базы знаний: {"signature", "entries", "pages": {вид: [страницы]}, "searches": {запрос: [страницы]}}
+_knowledge_cache = {}
+# Тексты поисковых запросов по ключу из callback_data (не сбрасываются при изменении базы)
+_search_queries = OrderedDict()
+
+
+def render_knowledge_entry(view: str, index: int, key: str, value: str) -> str:
+    """Строка записи базы знаний для страницы"""
+    if view == "admin":
+        return f"{index}. 🔑 {key}: {value[:100]}{'...' if len(value) > 100 else ''}\n\n"
+    return f"🔑 {key}:\n{value}\n\n"
+
+
+def paginate_knowledge(entries: list, header: str) -> list:
+    """Разбиение готовых строк на страницы в пределах лимита сообщения Telegram"""
+    # Запас под заголовок и строку с номером страницы; заголовок не больше половины сообщения
+    header = header[:MAX_MESSAGE_LENGTH // 2]
+    limit = MAX_MESSAGE_LENGTH - len(header) - 50
+    chunks, current, length = [], [], 0
+    for entry in entries:
+        if len(entry) > limit:
+            entry = entry[:limit - 5] + "...\n\n"
+        if current and (len(current) == KNOWLEDGE_PAGE_SIZE or length + len(entry) > limit):
+            chunks.append(current)
+            current, length = [], 0
+        current.append(entry)
+        length += len(entry)
+    if current:
+        chunks.append(current)
+
+    if not chunks:
+        return ["📚 База знаний пуста."]
+    return [
+        header + "".join(chunk) + (f"📄 Страница {i}/{len(chunks)}" if len(chunks) > 1 else "")
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+
+def get_knowledge_entries() -> list:
+    """Записи базы знаний с подготовленной для поиска строкой (кэшируются до изменения файла)"""
+    if "entries" not in _knowledge_cache or _knowledge_cache["signature"] != _knowledge_signature():
+        update_knowledge_cache(load_knowledge_base())
+    return _knowledge_cache["entries"]
+
+
+def _knowledge_signature():
+    """Время изменения и размер файла базы знаний"""
+    try:
+        stat = os.stat(KNOWLEDGE_BASE_FILE)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def update_knowledge_cache(knowledge_base: dict):
+    """Перестроение кэша записей из уже загруженной базы знаний (без повторного чтения файла)"""
+    _knowledge_cache.clear()
+    _knowledge_cache["signature"] = _knowledge_signature()
+    _knowledge_cache["entries"] = [
+        (key, value, f"{key}\n{value}".lower()) for key, value in knowledge_base.items()
+    ]
+    _knowledge_cache["pages"] = {}
+    _knowledge_cache["searches"] = OrderedDict()
+
+
+def get_knowledge_pages(view: str) -> list:
+    """Предварительно отрисованные страницы базы знаний"""
+    entries = get_knowledge_entries()
+    pages = _knowledge_cache["pages"]
+    if view not in pages:
+        pages[view] = paginate_knowledge(
+            [render_knowledge_entry(view, i, key, value) for i, (key, value, _) in enumerate(entries, 1)],
+            KNOWLEDGE_HEADERS[view]
+        )
+    return pages[view]
+
+
+def search_knowledge_pages(text: str) -> list:
+    """Страницы с результатами поиска по ключам и значениям базы знаний (последние запросы кэшируются)"""
+    entries = get_knowledge_entries()
+    searches = _knowledge_cache["searches"]
+    if text in searches:
+        searches.move_to_end(text)
+        return searches[text]
+
+    needle = text.lower()
+    preview = text if len(text) <= SEARCH_QUERY_PREVIEW else text[:SEARCH_QUERY_PREVIEW] + "…"
+    found = [
+        render_knowledge_entry("user", i, key, value)
+        for i, (key, value, haystack) in enumerate(entries, 1) if needle in haystack
+    ]
+    if found:
+        pages = paginate_knowledge(found, f"🔍 Результаты поиска «{preview}»:\n\n")
+    else:
+        pages = [f"🔍 По запросу «{preview}» ничего не найдено."]
+    _remember(searches, text, pages, KNOWLEDGE_SEARCH_CACHE_SIZE)
+    return pages
+
+
+def search_query_key(text: str) -> str:
+    """Короткий ключ поискового запроса для callback_data (лимит Telegram — 64 байта)"""
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+    _remember(_search_queries, key, text)
+    return key
+
+
+def knowledge_page_markup(view: str, page: int, total: int, search_key: str = None) -> InlineKeyboardMarkup:
+    """Клавиатура навигации по страницам базы знаний"""
+    # Кнопки результатов поиска несут ключ своего запроса, а не последнего запроса пользователя
+    suffix = f":{search_key}" if search_key else ""
+    keyboard = []
+    if total > 1:
+        keyboard.append([
+            InlineKeyboardButton("◀️", callback_data=f"kb:{view}:{(page - 1) % total}{suffix}"),
+            InlineKeyboardButton(f"{page + 1}/{total}", callback_data="kb:noop:0"),
+            InlineKeyboardButton("▶️", callback_data=f"kb:{view}:{(page + 1) % total}{suffix}"),
+        ])
+    keyboard.append([InlineKeyboardButton("🔍 Поиск", callback_data="kb:find:0")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def send_knowledge_page(update: Update, context: ContextTypes.DEFAULT_TYPE, view: str, pages: list,
+                              search_key: str = None):
+    """Отправка первой страницы базы знаний с клавиатурой навигации"""
+    await update.message.reply_text(pages[0], reply_markup=knowledge_page_markup(view, 0, len(pages), search_key))
+
+
+async def handle_knowledge_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка кнопок навигации и поиска по базе знаний"""
+    query = update.callback_query
+    _, view, page, *search_key = query.data.split(":")
+    search_key = search_key[0] if search_key else None
+
+    if view == "find":
+        context.user_data['knowledge_search'] = time.monotonic()
+        await answer_query(query)
+        await query.message.reply_text("🔍 Введите текст для поиска по базе знаний:")
+        return
+    if view == "admin" and query.from_user.id != OWNER_USER_ID:
+        await answer_query(query, "❌ Доступ запрещён.")
+        return
+
+    if view == "search":
+        # Хранится только текст запроса, страницы берутся из кэша поиска или строятся заново
+        search_query = _search_queries.get(search_key)
+        if not search_query:
+            await answer_query(query, "⌛ Результаты поиска устарели, повторите поиск.")
+            return
+        _search_queries.move_to_end(search_key)
+        pages = search_knowledge_pages(search_query)
+    elif view in KNOWLEDGE_HEADERS:
+        pages = get_knowledge_pages(view)
+    else:
+        await answer_query(query)
+        return
+
+    page = min(int(page), len(pages) - 1)
+    await safe_edit_message(query, pages[page], reply_markup=knowledge_page_markup(view, page, len(pages), search_key))
+
+
 async def handle_knowledge_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка действий с базой знаний"""
     text = update.message.text.strip()
@@ -223,14 +1079,7 @@ async def handle_knowledge_admin_action(update: Update, context: ContextTypes.DE
         context.user_data['knowledge_action'] = 'add_key'
         return True
     elif text == "📋 Просмотреть базу":
-        knowledge_base = load_knowledge_base()
-        if knowledge_base:
-            response = "📚 Текущая база знаний:\n\n"
-            for i, (key, value) in enumerate(knowledge_base.items(), 1):
-                response += f"{i}. 🔑 {key}: {value[:100]}{'...' if len(value) > 100 else ''}\n\n"
-        else:
-            response = "📚 База знаний пуста."
-        await update.message.reply_text(response)
+        await send_knowledge_page(update, context, "admin", get_knowledge_pages("admin"))
         return True
     elif text == "✏️ Редактировать знание":
         knowledge_base = load_knowledge_base()
@@ -252,6 +1101,24 @@ async def handle_knowledge_admin_action(update: Update, context: ContextTypes.DE
         await update.message.reply_text(response)
         context.user_data['knowledge_action'] = 'delete_key'
         return True
+    elif text == "📤 Импорт базы":
+        await update.message.reply_text(
+            "📤 Отправьте файл JSON, JSONL или CSV с записями базы знаний.\n"
+            "JSON: {\"ключ\": \"значение\"} или [{\"key\": ..., \"value\": ...}]\n"
+            "JSONL: по одной записи {\"key\": ..., \"value\": ...} в строке\n"
+            "CSV: столбцы key,value\n"
+            "Существующие ключи будут обновлены."
+        )
+        context.user_data['knowledge_action'] = 'import'
+        return True
+    elif text == "📥 Экспорт базы":
+        load_knowledge_base()
+        try:
+            with open(KNOWLEDGE_BASE_FILE, "rb") as f:
+                await update.message.reply_document(document=f, filename="knowledge_base.json", caption="📚 База знаний")
+        except Exception as e:
+            await update.message.reply_text(f"⚠️ Ошибка при отправке файла: {e}")
+        return True
     elif text == "🔙 Назад в админку":
         await show_admin_menu(update, context)
         return True
@@ -259,6 +1126,34 @@ async def handle_knowledge_admin_action(update: Update, context: ContextTypes.DE
     return False
 
 
+async def handle_knowledge_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Импорт базы знаний из присланного файла"""
+    if update.effective_user.id != OWNER_USER_ID or context.user_data.get('knowledge_action') != 'import':
+        return
+    del context.user_data['knowledge_action']
+
+    document = update.message.document
+    try:
+        fmt = knowledge_format(document.file_name)
+        telegram_file = await document.get_file()
+        data = await telegram_file.download_as_bytearray()
+        with io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="") as stream:
+            records = read_knowledge_import(stream, fmt)
+        result = apply_knowledge_batch(records)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Импорт отменён, база знаний не изменена:\n{e}")
+    except Exception as e:
+        await update.message.reply_text(f"⚠️ Ошибка при импорте: {e}")
+    else:
+        await update.message.reply_text(
+            f"✅ Импорт завершён!\n"
+            f"➕ Новых записей: {result['added']}\n"
+            f"✏️ Обновлено: {result['updated']}\n"
+            f"📚 Всего в базе: {result['total']}"
+        )
+    await show_knowledge_admin_menu(update, context)
+
+
 async def handle_knowledge_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода для управления базой знаний"""
     if 'knowledge_action' not in context.user_data:
@@ -267,7 +1162,11 @@ async def handle_knowledge_input(update: Update, context: ContextTypes.DEFAULT_T
     action = context.user_data['knowledge_action']
     text = update.message.text.strip()
     
-    if action == 'add_key':
+    if action == 'import':
+        # Вместо файла пришёл текст — выходим из режима импорта
+        del context.user_data['knowledge_action']
+        return False
+    elif action == 'add_key':
         context.user_data['new_key'] = text
         await update.message.reply_text("📝 Введите значение для этого ключа:")
         context.user_data['knowledge_action'] = 'add_value'
@@ -348,18 +1247,13 @@ async def handle_feedback_admin_action(update: Update, context: ContextTypes.DEF
         # Анализ отзывов
         if os.path.exists(EXCEL_FILE):
             try:
-                df = pd.read_excel(EXCEL_FILE)
-                total_feedbacks = len(df)
-                avg_rating = df['Оценка'].mean() if 'Оценка' in df.columns else 0
-                anonymous_count = len(df[df['Анонимный'] == 'Да']) if 'Анонимный' in df.columns else 0
-                
-                response = f"📈 Аналитика отзывов:\n\n"
-                response += f"📊 Всего отзывов: {total_feedbacks}\n"
-                response += f"⭐ Средняя оценка: {avg_rating:.1f}\n"
-                response += f"👤 Анонимных отзывов: {anonymous_count}\n"
-                response += f"📝 Публичных отзывов: {total_feedbacks - anonymous_count}"
-                
-                await update.message.reply_text(response)
+                analytics = await get_feedback_analytics(EXCEL_FILE)
+                await update.message.reply_text(analytics["text"])
+                await update.message.reply_document(
+                    document=analytics["file"],
+                    filename="feedback_report.xlsx",
+                    caption="📊 Сводка по отзывам"
+                )
             except Exception as e:
                 await update.message.reply_text(f"⚠️ Ошибка при анализе: {e}")
         else:
@@ -395,17 +1289,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     # Очищаем все состояния при запуске
     context.user_data.clear()
+    chat_sessions.end(user_id)
     
-    await update.message.reply_text(
-        f"👋 Привет{'ствую, владелец!' if is_owner else '!'}\nЯ — умный бот на базе Mistral AI 🧠",
-        reply_markup=ReplyKeyboardRemove()
+    await show_main_menu(
+        update, context, is_owner,
+        f"👋 Привет{'ствую, владелец!' if is_owner else '!'}\nЯ — умный бот на базе Mistral AI 🧠\n\n👇 Выберите действие:"
     )
-    await show_main_menu(update, context, is_owner)
 
 
 async def start_ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Начало диалога с нейросетью"""
-    context.user_data['ai_chat_history'] = []
+    chat_sessions.start(update.effective_user.id)
     context.user_data['current_state'] = AI_CHAT
     
     keyboard = [["🛑 Завершить диалог"]]
@@ -421,18 +1315,13 @@ async def start_ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def end_ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Завершение диалога с нейросетью"""
-    if 'ai_chat_history' in context.user_data:
-        del context.user_data['ai_chat_history']
+    chat_sessions.end(update.effective_user.id)
     if 'current_state' in context.user_data:
         del context.user_data['current_state']
     
-    await update.message.reply_text(
-        "✅ Диалог с нейросетью завершен.",
-        reply_markup=ReplyKeyboardRemove()
-    )
     user_id = update.effective_user.id
     is_owner = (user_id == OWNER_USER_ID)
-    await show_main_menu(update, context, is_owner)
+    await show_main_menu(update, context, is_owner, "✅ Диалог с нейросетью завершен.\n\n👇 Выберите действие:")
 
 
 async def handle_ai_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -443,21 +1332,21 @@ async def handle_ai_chat_message(update: Update, context: ContextTypes.DEFAULT_T
     
     await update.message.chat.send_action(action="typing")
     
-    chat_history = context.user_data.get('ai_chat_history', [])
+    user_id = update.effective_user.id
+    session = chat_sessions.get(user_id)
+    chat_history = session.messages() if session else []
     knowledge_base = load_knowledge_base()
     knowledge_context = search_knowledge_base(update.message.text, knowledge_base)
     
     response = await call_mistral_api(update.message.text, chat_history, knowledge_context)
     
-    chat_history.append({"role": "user", "content": update.message.text})
-    chat_history.append({"role": "assistant", "content": response})
-    context.user_data['ai_chat_history'] = chat_history
-    
-    await update.message.reply_text(response)
+    chat_sessions.append(user_id, "user", update.message.text)
+    chat_sessions.append(user_id, "assistant", response)
     
+    # Ответ и клавиатура диалога отправляются одним сообщением
     keyboard = [["🛑 Завершить диалог"]]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
-    await update.message.reply_text("👇 Продолжайте диалог или завершите его:", reply_markup=reply_markup)
+    await update.message.reply_text(response, reply_markup=reply_markup)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -482,6 +1371,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await show_feedback_admin_menu(update, context)
             return
     
+    # Поиск по базе знаний (после нажатия кнопки «🔍 Поиск»); кнопка меню или долгая пауза отменяют поиск
+    search_requested_at = context.user_data.pop('knowledge_search', None)
+    if (search_requested_at is not None and text not in MENU_BUTTONS
+            and time.monotonic() - search_requested_at < KNOWLEDGE_SEARCH_TTL):
+        await send_knowledge_page(update, context, "search", search_knowledge_pages(text), search_query_key(text))
+        return
+    
     # Если активен диалог с нейросетью
     if current_state == AI_CHAT:
         await handle_ai_chat_message(update, context)
@@ -497,22 +1393,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
         elif text == "📈 Статистика":
             # Показ статистики
-            stats_text = "📈 Статистика бота:\n\n"
-            stats_text += "📊 Отзывы: "
-            if os.path.exists(EXCEL_FILE):
-                try:
-                    df = pd.read_excel(EXCEL_FILE)
-                    stats_text += f"{len(df)} записей\n"
-                except:
-                    stats_text += "ошибка чтения\n"
-            else:
-                stats_text += "нет данных\n"
-            
-            stats_text += "📚 База знаний: "
-            knowledge_base = load_knowledge_base()
-            stats_text += f"{len(knowledge_base)} записей\n"
-            
-            await update.message.reply_text(stats_text)
+            await update.message.reply_text(build_stats_text())
             return
         elif text == "⚙️ Настройки":
             await update.message.reply_text("⚙️ Настройки бота (в разработке)")
@@ -556,46 +1437,19 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             # Для владельца показываем меню управления
             await show_knowledge_admin_menu(update, context)
         else:
-            # Для обычных пользователей показываем содержимое
-            knowledge_base = load_knowledge_base()
-            if knowledge_base:
-                response = "📚 Информация из базы знаний:\n\n"
-                for key, value in knowledge_base.items():
-                    response += f"🔑 {key}:\n{value}\n\n"
-            else:
-                response = "📚 База знаний пуста."
-            await update.message.reply_text(response)
-            await show_main_menu(update, context, False)
+            # Для обычных пользователей показываем содержимое постранично
+            await send_knowledge_page(update, context, "user", get_knowledge_pages("user"))
         return
     elif text == "📊 Статистика" and is_owner:
         # Прямой доступ к статистике
-        stats_text = "📈 Статистика бота:\n\n"
-        stats_text += "📊 Отзывы: "
-        if os.path.exists(EXCEL_FILE):
-            try:
-                df = pd.read_excel(EXCEL_FILE)
-                stats_text += f"{len(df)} записей\n"
-            except:
-                stats_text += "ошибка чтения\n"
-        else:
-            stats_text += "нет данных\n"
-        
-        stats_text += "📚 База знаний: "
-        knowledge_base = load_knowledge_base()
-        stats_text += f"{len(knowledge_base)} записей\n"
-        
-        await update.message.reply_text(stats_text)
+        await update.message.reply_text(build_stats_text())
         return
     elif text == "👑 Админка" and is_owner:
         await show_admin_menu(update, context)
         return
     
     # Если ни одна функция не активна - предлагаем выбрать действие
-    await update.message.reply_text(
-        "🤔 Пожалуйста, выберите действие из меню:",
-        reply_markup=ReplyKeyboardRemove()
-    )
-    await show_main_menu(update, context, is_owner)
+    await show_main_menu(update, context, is_owner, "🤔 Пожалуйста, выберите действие из меню:")
 
 
 # === ОБРАТНАЯ СВЯЗЬ ===
@@ -614,7 +1468,6 @@ async def feedback_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def handle_anonymous_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
 
     if query.data == "cancel":
         await safe_edit_message(query, "❌ Анкета отменена.")
@@ -636,7 +1489,6 @@ async def handle_anonymous_choice(update: Update, context: ContextTypes.DEFAULT_
 
 async def handle_rating_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
 
     if query.data == "cancel":
         await safe_edit_message(query, "❌ Анкета отменена.")
@@ -680,10 +1532,9 @@ async def handle_comment(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         print(f"[Send to owner error] {e}")
 
     await update.message.reply_sticker(sticker=THANKS_ANIMATION)
-    await update.message.reply_text("🙏 Спасибо за отзыв!", reply_markup=ReplyKeyboardRemove())
     user_id = update.effective_user.id
     is_owner = (user_id == OWNER_USER_ID)
-    await show_main_menu(update, context, is_owner)
+    await show_main_menu(update, context, is_owner, "🙏 Спасибо за отзыв!")
     context.user_data.clear()
     return ConversationHandler.END
 
@@ -701,6 +1552,7 @@ async def save_feedback_to_excel(file_path, timestamp, user_id, rating, comment,
         df = pd.read_excel(file_path) if os.path.exists(file_path) else pd.DataFrame()
         df = pd.concat([df, df_new], ignore_index=True)
         df.to_excel(file_path, index=False, engine='openpyxl')
+        cache_new_feedback(file_path, new_row, len(df))
         print(f"[Excel] ✅ Сохранено. Всего: {len(df)} записей")
     except Exception as e:
         print(f"[Excel Error] {e}")
@@ -727,7 +1579,6 @@ async def get_feedback_file(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка callback query (для inline кнопок)"""
     query = update.callback_query
-    await query.answer()
     
     if query.data == "confirm_clear":
         # Очистка отзывов
@@ -739,36 +1590,36 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
                 # Создаем новый пустой файл
                 with open(FEEDBACK_FILE, "w", encoding="utf-8") as f:
                     f.write("Обратная связь:\n\n")
-            await query.edit_message_text("✅ Все отзывы успешно очищены!")
+            await safe_edit_message(query, "✅ Все отзывы успешно очищены!")
         except Exception as e:
-            await query.edit_message_text(f"❌ Ошибка при очистке: {e}")
+            await safe_edit_message(query, f"❌ Ошибка при очистке: {e}")
     elif query.data == "cancel_clear":
-        await query.edit_message_text("❌ Очистка отзывов отменена.")
+        await safe_edit_message(query, "❌ Очистка отзывов отменена.")
+    else:
+        await answer_query(query)
+        return
     
-    user_id = query.from_user.id
-    is_owner = (user_id == OWNER_USER_ID)
-    await show_feedback_admin_menu(query, context)
+    # Если владелец всё ещё в меню отзывов, его клавиатура уже на экране; кнопки подтверждения
+    # остаются активными и после ухода из меню — тогда меню отзывов показывается заново
+    if context.user_data.get('current_state') != ADMIN_FEEDBACK:
+        await show_feedback_admin_menu(update, context)
 
 
 # === ЗАПУСК ===
 
-def main():
-    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
-    logging.getLogger("httpx").setLevel(logging.WARNING)
-
-    os.makedirs(BASE_DIR, exist_ok=True)
-    if not os.path.exists(FEEDBACK_FILE):
-        with open(FEEDBACK_FILE, "w", encoding="utf-8") as f:
-            f.write("Обратная связь:\n\n")
-
-    app = Application.builder().token(TOKEN).build()
+def build_application(builder=None) -> Application:
+    """Создание приложения со всеми обработчиками (builder можно подменить, например, в нагрузочном тесте)"""
+    if builder is None:
+        # AIORateLimiter придерживает запросы, чтобы не упираться во flood-лимиты Telegram
+        builder = Application.builder().token(TOKEN).rate_limiter(AIORateLimiter())
+    app = builder.build()
 
     # ✅ ConversationHandler для анкеты
     feedback_handler = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex("^📩 Обратная связь$"), feedback_start)],
         states={
-            ANONYMOUS: [CallbackQueryHandler(handle_anonymous_choice)],
-            RATING: [CallbackQueryHandler(handle_rating_choice)],
+            ANONYMOUS: [CallbackQueryHandler(handle_anonymous_choice, pattern="^(anon_yes|anon_no|cancel)$")],
+            RATING: [CallbackQueryHandler(handle_rating_choice, pattern="^([1-5]|cancel)$")],
             COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_comment)],
         },
         fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
@@ -778,16 +1629,39 @@ def main():
     app.add_handler(feedback_handler)
 
     # Обработчики callback query
+    app.add_handler(CallbackQueryHandler(handle_knowledge_page, pattern="^kb:"))
     app.add_handler(CallbackQueryHandler(handle_callback_query))
 
     # Общие обработчики
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(MessageHandler(filters.Document.ALL, handle_knowledge_document))
     app.add_handler(CommandHandler("getfeedback", get_feedback_file))
+    return app
+
+
+def main():
+    if not TOKEN:
+        raise ValueError("Не указан TELEGRAM_BOT_TOKEN в переменных окружения!")
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    os.makedirs(BASE_DIR, exist_ok=True)
+    chat_sessions.clear_spilled()
+    if not os.path.exists(FEEDBACK_FILE):
+        with open(FEEDBACK_FILE, "w", encoding="utf-8") as f:
+            f.write("Обратная связь:\n\n")
+
+    app = build_application()
 
     print("✅ Бот запущен. Все функции работают.")
     app.run_polling()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) == 3 and sys.argv[1] in ("import-kb", "export-kb"):
+        run_knowledge_cli(sys.argv[1], sys.argv[2])
+    elif len(sys.argv) > 1:
+        print("Использование: python main.py [import-kb|export-kb ФАЙЛ.json|.jsonl|.csv]")
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,165 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+
+NOW = datetime(2026, 10, 19, 12, 0, 0)
+COLUMNS = ["Дата и время", "Пользователь", "Оценка", "Комментарий", "Анонимный"]
+
+
+def row(seconds_ago, user, rating, comment, anonymous="Нет"):
+    timestamp = (NOW - timedelta(seconds=seconds_ago)).strftime("%Y-%m-%d %H:%M:%S")
+    return [timestamp, user, rating, comment, anonymous]
+
+
+def write_workbook(path, rows):
+    pd.DataFrame(rows, columns=COLUMNS).to_excel(path, index=False)
+    return str(path)
+
+
+def save(path, seconds_ago, user, rating, comment, is_anon=False):
+    asyncio.run(main.save_feedback_to_excel(path, NOW - timedelta(seconds=seconds_ago), user, rating, comment, is_anon))
+
+
+def analyze(path):
+    return main.analyze_feedback_arrays(main.load_feedback_arrays(path), NOW)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    main._feedback_analytics_cache.clear()
+    yield
+    main._feedback_analytics_cache.clear()
+
+
+def test_count_terms_once_per_comment():
+    comments = ["Бот бот БОТ отвечает", "медленно отвечает", "ок", ""]
+    counts = main.count_feedback_terms(comments, [1, 3, 2, 5])
+    assert counts == {"бот": 1, "отвечает": 4, "медленно": 3}
+
+
+def test_count_terms_ignores_separator_lookalikes():
+    # Маркер-разделитель в верхнем регистре не должен попадать в слова и сдвигать комментарии
+    counts = main.count_feedback_terms(["sep SEP раз", "два"], [1, 4])
+    assert counts == {"sep": 1, "раз": 1, "два": 4}
+
+
+def test_count_terms_empty():
+    assert main.count_feedback_terms([], []) == {}
+    assert main.count_feedback_terms(["", "ок"], [2, 1]) == {}
+
+
+@pytest.mark.parametrize("columns", [COLUMNS, []])
+def test_empty_workbook(tmp_path, columns):
+    path = tmp_path / "feedback.xlsx"
+    pd.DataFrame(columns=columns).to_excel(path, index=False)
+    stats = analyze(str(path))
+    assert stats["total"] == 0
+    assert stats["unique_users"] == 0
+    assert stats["duplicates"] == stats["spam"] == 0
+    assert stats["top_users"] == stats["spam_users"] == stats["top_terms"] == []
+    assert "Всего отзывов: 0" in main.format_feedback_report(stats)
+    assert main.render_feedback_report(stats)
+
+
+def test_ratings_windows_and_users(tmp_path):
+    path = write_workbook(tmp_path / "feedback.xlsx", [
+        row(3600, 1, 5, "отлично"),
+        row(3 * 86400, 1, 3, "нормально"),
+        row(20 * 86400, 2, 1, "плохо", "Да"),
+        row(60 * 86400, 3, 4, "хорошо"),
+        ["не дата", 3, 0, "без оценки", "Нет"],
+    ])
+    stats = analyze(path)
+    assert stats["total"] == 5
+    assert stats["avg_rating"] == pytest.approx(13 / 4)
+    assert stats["anonymous"] == 1
+    assert stats["distribution"].tolist() == [1, 0, 1, 1, 1]
+    assert [window["count"] for window in stats["windows"]] == [1, 2, 3]
+    assert stats["windows"][2]["avg_rating"] == pytest.approx(3.0)
+    assert stats["unique_users"] == 3
+    assert [user for user, _, _ in stats["top_users"]] == ["1", "3", "2"]
+
+
+def test_duplicates_and_spam(tmp_path):
+    path = write_workbook(tmp_path / "feedback.xlsx", [
+        # Пользователь 1: три одинаковых отзыва подряд — два дубликата и два спама
+        row(1000, 1, 5, "одно и то же"),
+        row(990, 1, 5, "одно и то же"),
+        row(980, 1, 5, "одно и то же"),
+        # Пользователь 2: тот же текст — не дубликат; второй отзыв позже интервала — не спам
+        row(1000, 2, 4, "одно и то же"),
+        row(1000 - main.SPAM_INTERVAL_SECONDS, 2, 4, "другое"),
+        # Пользователь 3: два разных отзыва почти одновременно — спам без дубликатов
+        row(500, 3, 2, "первый"),
+        row(499, 3, 2, "второй"),
+    ])
+    stats = analyze(path)
+    assert stats["duplicates"] == 2
+    assert stats["spam"] == 3
+    assert stats["spam_users"] == ["1", "3"]
+
+
+def test_top_terms_count_each_comment_once(tmp_path):
+    path = write_workbook(tmp_path / "feedback.xlsx", [
+        row(10, 1, 5, "быстро быстро быстро"),
+        row(20, 2, 5, "Быстро и удобно"),
+        row(30, 3, 5, "удобно"),
+        row(40, 4, 5, "удобно"),
+    ])
+    assert analyze(path)["top_terms"] == [("удобно", 3), ("быстро", 2)]
+
+
+def test_append_matches_fresh_load(tmp_path):
+    path = str(tmp_path / "feedback.xlsx")
+    save(path, 7200, 1, 5, "Бот отвечает быстро")
+    save(path, 3600, 2, 2, "медленно отвечает", is_anon=True)
+    asyncio.run(main.get_feedback_analytics(path))
+
+    # Новые отзывы дописываются в кэш, файл повторно не читается
+    save(path, 30, 2, 2, "медленно отвечает", is_anon=True)
+    save(path, 20, 3, 4, "новое слово")
+    save(path, 10, 3, 1, "новое слово")
+    cached = main._feedback_analytics_cache[path]
+    assert len(cached["data"]["ratings"]) == 5
+
+    appended = main.analyze_feedback_arrays(cached["data"], NOW)
+    fresh = analyze(path)
+    assert main.format_feedback_report(appended) == main.format_feedback_report(fresh)
+    assert appended["duplicates"] == 2 and appended["spam"] == 1
+
+    # Отчёт из кэша пересчитан после дописывания
+    assert "Всего отзывов: 5" in asyncio.run(main.get_feedback_analytics(path))["text"]
+
+
+def test_append_to_cache_of_empty_workbook(tmp_path):
+    path = str(tmp_path / "feedback.xlsx")
+    pd.DataFrame(columns=COLUMNS).to_excel(path, index=False)
+    asyncio.run(main.get_feedback_analytics(path))
+    save(path, 10, 1, 5, "первый отзыв")
+    data = main._feedback_analytics_cache[path]["data"]
+    assert main.format_feedback_report(main.analyze_feedback_arrays(data, NOW)) == \
+        main.format_feedback_report(analyze(path))
+
+
+def test_stale_cache_is_dropped(tmp_path):
+    path = str(tmp_path / "feedback.xlsx")
+    save(path, 20, 1, 5, "первый")
+    asyncio.run(main.get_feedback_analytics(path))
+    # Файл изменён в обход бота: кэш не совпадает по числу строк и сбрасывается
+    write_workbook(path, [row(20, 1, 5, "первый"), row(15, 2, 4, "второй")])
+    save(path, 10, 3, 3, "третий")
+    assert path not in main._feedback_analytics_cache
+    assert "Всего отзывов: 3" in asyncio.run(main.get_feedback_analytics(path))["text"]
+
+
+def test_cached_report_is_reused(tmp_path):
+    path = str(tmp_path / "feedback.xlsx")
+    save(path, 10, 1, 5, "отзыв")
+    first = asyncio.run(main.get_feedback_analytics(path))
+    assert asyncio.run(main.get_feedback_analytics(path)) is first
+    assert isinstance(main._feedback_analytics_cache[path]["data"]["timestamps"], np.ndarray)
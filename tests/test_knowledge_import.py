@@ -0,0 +1,158 @@
+import io
+import json
+
+import pytest
+
+import main
+
+
+def read(text, fmt):
+    return main.read_knowledge_import(io.StringIO(text), fmt)
+
+
+@pytest.fixture
+def knowledge_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "KNOWLEDGE_BASE_FILE", str(tmp_path / "knowledge_base.json"))
+    main._knowledge_cache.clear()
+    yield tmp_path / "knowledge_base.json"
+    main._knowledge_cache.clear()
+
+
+@pytest.mark.parametrize("record, expected", [
+    ({"key": "к", "value": "з"}, ("к", "з")),
+    ({"к": "з"}, ("к", "з")),
+    (["к", "з"], ("к", "з")),
+    (("к", "з"), ("к", "з")),
+])
+def test_knowledge_record_shapes(record, expected):
+    assert main._knowledge_record(record) == expected
+
+
+@pytest.mark.parametrize("record", [{"key": "к", "value": "з", "x": 1}, {"a": 1, "b": 2}, ["к"], "к", 5])
+def test_knowledge_record_rejects_non_pairs(record):
+    with pytest.raises(ValueError):
+        main._knowledge_record(record)
+
+
+def test_json_object_and_list():
+    assert read('{"о боте": "Бот", "помощь": "Меню"}', "json") == {"о боте": "Бот", "помощь": "Меню"}
+    assert read('[{"key": "а", "value": "1"}, ["б", "2"]]', "json") == {"а": "1", "б": "2"}
+
+
+@pytest.mark.parametrize("text", ["5", '"строка"', "null"])
+def test_json_scalar_top_level_is_rejected(text):
+    with pytest.raises(ValueError, match="файл не разобран"):
+        read(text, "json")
+
+
+def test_jsonl_skips_blank_lines_and_strips_whitespace():
+    text = '{"key": " а ", "value": " 1 "}\n\n{"б": "2"}\n'
+    assert read(text, "jsonl") == {"а": "1", "б": "2"}
+
+
+def test_jsonl_invalid_line_reports_line_number():
+    with pytest.raises(ValueError, match="строка 2"):
+        read('{"а": "1"}\nnot json\n', "jsonl")
+
+
+@pytest.mark.parametrize("header", ["key,value\n", "ключ,значение\n", "Key , Value\n", ""])
+def test_csv_header_is_optional(header):
+    assert read(header + "а,1\nб,\"2, с запятой\"\n", "csv") == {"а": "1", "б": "2, с запятой"}
+
+
+def test_csv_header_only_skipped_on_first_line():
+    assert read("а,1\nkey,value\n", "csv") == {"а": "1", "key": "value"}
+
+
+def test_later_duplicate_key_wins():
+    assert read('{"key": "а", "value": "1"}\n{"key": "а", "value": "2"}\n', "jsonl") == {"а": "2"}
+
+
+def test_invalid_records_reject_whole_file():
+    text = 'а,1\n,пустой ключ\nб,\nв\n' + "x" * (main.MAX_KNOWLEDGE_KEY_LENGTH + 1) + ",1\n"
+    with pytest.raises(ValueError) as error:
+        read(text, "csv")
+    message = str(error.value)
+    assert "запись 2: пустой ключ" in message
+    assert "запись 3: пустое значение" in message
+    assert "запись 4: ожидается пара ключ/значение" in message
+    assert f"запись 5: ключ длиннее {main.MAX_KNOWLEDGE_KEY_LENGTH} символов" in message
+
+
+def test_non_string_keys_and_values_are_reported():
+    with pytest.raises(ValueError) as error:
+        read('[{"цена": 100}, [5, "пять"], {"key": "пусто", "value": null}]', "json")
+    message = str(error.value)
+    assert "запись 1: значение должно быть строкой" in message
+    assert "запись 2: ключ должен быть строкой" in message
+    assert "запись 3: значение должно быть строкой" in message
+
+
+def test_key_length_is_checked_after_strip():
+    key = "к" * main.MAX_KNOWLEDGE_KEY_LENGTH
+    assert read(json.dumps({f"  {key}  ": "значение"}), "json") == {key: "значение"}
+
+
+def test_error_list_is_cut_off():
+    text = "".join(json.dumps({"key": "", "value": "x"}) + "\n" for _ in range(main.MAX_IMPORT_ERRORS + 5))
+    with pytest.raises(ValueError) as error:
+        read(text, "jsonl")
+    assert len(str(error.value).splitlines()) == main.MAX_IMPORT_ERRORS
+
+
+@pytest.mark.parametrize("filename, fmt", [("kb.json", "json"), ("KB.JSONL", "jsonl"), ("data/kb.csv", "csv")])
+def test_knowledge_format(filename, fmt):
+    assert main.knowledge_format(filename) == fmt
+
+
+@pytest.mark.parametrize("filename", ["kb.txt", "kb", None])
+def test_knowledge_format_rejects_unknown(filename):
+    with pytest.raises(ValueError):
+        main.knowledge_format(filename)
+
+
+def test_apply_batch_writes_once_and_refreshes_cache(knowledge_file):
+    main.save_knowledge_base({"а": "старое"})
+    assert [key for key, _, _ in main.get_knowledge_entries()] == ["а"]
+
+    result = main.apply_knowledge_batch({"а": "новое", "б": "2"})
+
+    assert result == {"added": 1, "updated": 1, "total": 2}
+    assert json.loads(knowledge_file.read_text(encoding="utf-8")) == {"а": "новое", "б": "2"}
+    assert not (knowledge_file.parent / "knowledge_base.json.tmp").exists()
+    assert [(key, value) for key, value, _ in main.get_knowledge_entries()] == [("а", "новое"), ("б", "2")]
+
+
+@pytest.mark.parametrize("content", ['{"а": "1", "б"', '["а", "б"]', b"\xff\xfe"])
+def test_apply_batch_keeps_unreadable_knowledge_base(knowledge_file, content):
+    if isinstance(content, bytes):
+        knowledge_file.write_bytes(content)
+    else:
+        knowledge_file.write_text(content, encoding="utf-8")
+    before = knowledge_file.read_bytes()
+
+    with pytest.raises(ValueError, match="не прочитан"):
+        main.apply_knowledge_batch({"в": "3"})
+
+    assert knowledge_file.read_bytes() == before
+
+
+def test_cli_import_keeps_unreadable_knowledge_base(knowledge_file, tmp_path):
+    knowledge_file.write_text('{"а": "1", "б"', encoding="utf-8")
+    import_file = tmp_path / "import.json"
+    import_file.write_text('{"в": "3"}', encoding="utf-8")
+
+    with pytest.raises(SystemExit, match="Импорт отменён"):
+        main.run_knowledge_cli("import-kb", str(import_file))
+
+    assert knowledge_file.read_text(encoding="utf-8") == '{"а": "1", "б"'
+
+
+@pytest.mark.parametrize("fmt", main.KNOWLEDGE_FORMATS)
+def test_export_import_round_trip(fmt):
+    knowledge_base = {"о боте": "Бот, \"умный\"\nассистент", "помощь": "Меню"}
+    stream = io.StringIO(newline="")
+    main.write_knowledge_export(knowledge_base, stream, fmt)
+    stream.seek(0)
+    assert main.read_knowledge_import(stream, fmt) == knowledge_base
@@ -0,0 +1,150 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def knowledge_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "KNOWLEDGE_BASE_FILE", str(tmp_path / "knowledge_base.json"))
+    main._knowledge_cache.clear()
+    main._search_queries.clear()
+    yield tmp_path / "knowledge_base.json"
+    main._knowledge_cache.clear()
+    main._search_queries.clear()
+
+
+class FakeQuery:
+    """Callback query с сообщением, которое можно редактировать"""
+    ids = iter(range(10 ** 6))
+
+    def __init__(self, data, message_id=1, user_id=main.OWNER_USER_ID):
+        self.id = f"q{next(self.ids)}"
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.inline_message_id = None
+        self.message = SimpleNamespace(chat_id=1, message_id=message_id, text="", reply_markup=None)
+        self.edited = None
+        self.answered = []
+
+    async def edit_message_text(self, text, reply_markup=None):
+        self.edited = (text, reply_markup)
+
+    async def answer(self, text=None):
+        self.answered.append(text)
+
+
+def press(data, message_id=1, user_id=main.OWNER_USER_ID):
+    query = FakeQuery(data, message_id, user_id)
+    update = SimpleNamespace(callback_query=query)
+    asyncio.run(main.handle_knowledge_page(update, SimpleNamespace(user_data={})))
+    return query
+
+
+def callbacks(markup):
+    return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+
+def test_pages_fit_message_limit_with_oversized_entries_and_header():
+    entries = [f"🔑 {i}:\n" + "я" * 10000 + "\n\n" for i in range(3)] + ["🔑 short\n\n"] * 30
+    for header in ["📚 Заголовок:\n\n", "Я" * 10000]:
+        pages = main.paginate_knowledge(entries, header)
+        assert all(len(page) <= main.MAX_MESSAGE_LENGTH for page in pages)
+        assert pages[0].startswith(header[:100])
+        assert "...\n\n" in pages[0]
+
+
+def test_pages_hold_at_most_page_size_entries():
+    entries = [f"🔑 {i}\n\n" for i in range(main.KNOWLEDGE_PAGE_SIZE * 2 + 3)]
+    pages = main.paginate_knowledge(entries, "📚\n\n")
+    assert [page.count("🔑") for page in pages] == [main.KNOWLEDGE_PAGE_SIZE, main.KNOWLEDGE_PAGE_SIZE, 3]
+    assert pages[-1].endswith("📄 Страница 3/3")
+
+
+def test_single_and_empty_pages():
+    assert main.paginate_knowledge(["🔑 а\n\n"], "📚\n\n") == ["📚\n\n🔑 а\n\n"]
+    assert main.paginate_knowledge([], "📚\n\n") == ["📚 База знаний пуста."]
+
+
+def test_admin_view_truncates_values():
+    entry = main.render_knowledge_entry("admin", 3, "ключ", "з" * 150)
+    assert entry == f"3. 🔑 ключ: {'з' * 100}...\n\n"
+
+
+def test_pages_are_cached_until_knowledge_base_is_saved(knowledge_file):
+    main.save_knowledge_base({"а": "1"})
+    pages = main.get_knowledge_pages("user")
+    assert main.get_knowledge_pages("user") is pages
+
+    main.save_knowledge_base({"а": "1", "б": "2"})
+    assert "🔑 б" in main.get_knowledge_pages("user")[0]
+
+
+def test_pages_follow_external_file_changes(knowledge_file):
+    main.save_knowledge_base({"а": "1"})
+    main.get_knowledge_pages("admin")
+    knowledge_file.write_text('{"в": "изменено вручную"}', encoding="utf-8")
+    assert "🔑 в" in main.get_knowledge_pages("admin")[0]
+
+
+def test_search_matches_keys_and_values_case_insensitively(knowledge_file):
+    main.save_knowledge_base({"Контакты": "Пишите @owner", "помощь": "Нажмите МЕНЮ", "прочее": "—"})
+    assert "🔑 Контакты" in main.search_knowledge_pages("кОНТАКТ")[0]
+    page = main.search_knowledge_pages("меню")[0]
+    assert "🔑 помощь" in page and "Контакты" not in page
+    assert "ничего не найдено" in main.search_knowledge_pages("погода")[0]
+
+
+def test_search_header_is_shortened(knowledge_file):
+    pages = main.search_knowledge_pages("я" * 5000)
+    assert all(len(page) <= main.MAX_MESSAGE_LENGTH for page in pages)
+    assert "я" * main.SEARCH_QUERY_PREVIEW + "…" in pages[0]
+
+
+def test_search_cache_is_bounded_and_invalidated(knowledge_file, monkeypatch):
+    monkeypatch.setattr(main, "KNOWLEDGE_SEARCH_CACHE_SIZE", 2)
+    main.save_knowledge_base({"а": "1"})
+    first = main.search_knowledge_pages("а")
+    assert main.search_knowledge_pages("а") is first
+    main.search_knowledge_pages("б")
+    main.search_knowledge_pages("в")
+    assert list(main._knowledge_cache["searches"]) == ["б", "в"]
+
+    main.save_knowledge_base({"а": "новое"})
+    assert "новое" in main.search_knowledge_pages("а")[0]
+
+
+def test_search_buttons_page_through_their_own_query(knowledge_file):
+    main.save_knowledge_base({f"кот {i}": "мяу" for i in range(15)} | {f"пёс {i}": "гав" for i in range(25)})
+    cats = main.search_query_key("кот")
+    dogs = main.search_query_key("пёс")
+
+    markup = main.knowledge_page_markup("search", 0, 2, cats)
+    assert all(len(data.encode("utf-8")) <= 64 for data in callbacks(markup))
+
+    # Кнопка старого сообщения листает свой запрос, хотя последним искали другое
+    query = press(f"kb:search:1:{cats}", message_id=10)
+    assert "🔑 кот 14" in query.edited[0] and "пёс" not in query.edited[0]
+    assert f"kb:search:0:{cats}" in callbacks(query.edited[1])
+
+    query = press(f"kb:search:2:{dogs}", message_id=11)
+    assert "🔑 пёс 24" in query.edited[0]
+
+
+def test_unknown_search_key_asks_to_search_again(knowledge_file):
+    main.save_knowledge_base({"а": "1"})
+    for data in ["kb:search:0:0123456789abcdef", "kb:search:0"]:
+        query = press(data)
+        assert query.edited is None
+        assert "устарели" in query.answered[0]
+
+
+def test_admin_pages_are_owner_only(knowledge_file):
+    main.save_knowledge_base({"а": "1"})
+    query = press("kb:admin:0", user_id=main.OWNER_USER_ID + 1)
+    assert query.edited is None and "запрещён" in query.answered[0]
+    query = press("kb:admin:5", message_id=20)
+    assert query.edited[0].startswith(main.KNOWLEDGE_HEADERS["admin"])
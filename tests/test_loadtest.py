@@ -0,0 +1,49 @@
+import pytest
+
+import main
+import loadtest
+
+
+@pytest.fixture(autouse=True)
+def restore_main_settings(monkeypatch):
+    """Прогон перенастраивает пути и Mistral в main — возвращаем их после теста"""
+    for name in ("BASE_DIR", "FEEDBACK_FILE", "EXCEL_FILE", "KNOWLEDGE_BASE_FILE", "MISTRAL_API_URL", "MISTRAL_API_KEY"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(main.chat_sessions, "spill_dir", main.chat_sessions.spill_dir)
+
+
+def test_run_processes_all_updates_offline(tmp_path):
+    report = loadtest.run([
+        "--updates", "50", "--rate", "50",
+        "--telegram-latency", "0", "--telegram-jitter", "0",
+        "--mistral-latency", "0", "--mistral-jitter", "0",
+        "--no-rate-limiter", "--json", str(tmp_path / "report.json"),
+    ])
+
+    assert report["updates_sent"] == 50
+    assert report["updates_processed"] == 50
+    assert report["updates_unprocessed"] == 0
+    assert report["errors"] == {"handlers": 0, "telegram_injected": 0, "mistral_injected": 0}
+    assert report["mistral_calls"] > 0
+    assert report["telegram_calls"]["getMe"] == 1
+    latency = report["latency_ms"]
+    assert 0 < latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
+    assert report["memory"]
+    assert (tmp_path / "report.json").exists()
+
+
+def test_injected_errors_are_counted():
+    report = loadtest.run([
+        "--updates", "40", "--rate", "100", "--mix", "ai=1",
+        "--telegram-latency", "0", "--telegram-jitter", "0",
+        "--mistral-latency", "0", "--mistral-jitter", "0", "--mistral-error-rate", "1",
+        "--no-rate-limiter",
+    ])
+
+    assert report["updates_processed"] == 40
+    assert report["errors"]["mistral_injected"] == report["mistral_calls"] > 0
+
+
+def test_parse_args_requires_a_limit():
+    with pytest.raises(SystemExit):
+        loadtest.parse_args(["--rate", "5"])
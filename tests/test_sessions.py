@@ -0,0 +1,196 @@
+import sys
+import types
+
+import pytest
+
+import main
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(main, "time", types.SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+
+def fill(manager, user_id, turns=4, length=200):
+    for i in range(turns):
+        manager.append(user_id, "user" if i % 2 == 0 else "assistant", f"{user_id}-{i}-" + "x" * length)
+
+
+def test_chat_turn_is_compact_and_interns_roles():
+    first = main.ChatTurn("".join(["us", "er"]), "вопрос")
+    second = main.ChatTurn("".join(["u", "ser"]), "ещё вопрос")
+    assert not hasattr(first, "__dict__")
+    assert first.role is second.role
+
+
+def test_messages_keep_order_and_format(clock):
+    manager = main.SessionManager(10 ** 6, 60)
+    manager.start(1)
+    manager.append(1, "user", "привет")
+    manager.append(1, "assistant", "здравствуйте")
+    assert manager.get(1).messages() == [
+        {"role": "user", "content": "привет"},
+        {"role": "assistant", "content": "здравствуйте"},
+    ]
+
+
+def test_size_accounting_matches_sessions(clock):
+    manager = main.SessionManager(10 ** 6, 60)
+    for user_id in (1, 2, 3):
+        manager.start(user_id)
+        fill(manager, user_id)
+    usage = manager.memory_usage()
+    assert usage["total"] == sum(usage["sessions"].values())
+    session = manager.get(1)
+    assert session.size == sys.getsizeof(session) + sum(turn.size() + 8 for turn in session.turns)
+
+    manager.end(2)
+    assert manager.memory_usage()["total"] == sum(manager.memory_usage()["sessions"].values())
+    assert 2 not in manager.memory_usage()["sessions"]
+
+
+def test_budget_spills_least_recent_and_restores(clock, tmp_path):
+    manager = main.SessionManager(10 ** 6, 60, str(tmp_path))
+    for user_id in (1, 2, 3):
+        manager.start(user_id)
+        fill(manager, user_id)
+        clock.advance(1)
+    expected = manager.get(1).messages()
+    size_before_spill = manager.memory_usage()["sessions"][2]
+    clock.advance(1)
+    manager.memory_budget = manager.total_size - 1
+
+    manager.append(3, "user", "ещё")
+
+    usage = manager.memory_usage()
+    assert usage["total"] <= manager.memory_budget
+    assert usage["spilled"] >= 1
+    assert 2 not in usage["sessions"]
+    assert (tmp_path / "2.json").exists()
+
+    manager.memory_budget = 10 ** 6
+    restored = manager.get(2)
+    assert restored is not None and len(restored.turns) == 4
+    assert restored.size == size_before_spill
+    assert not (tmp_path / "2.json").exists()
+    assert manager.get(1).messages() == expected
+    assert manager.memory_usage()["total"] == sum(manager.memory_usage()["sessions"].values())
+
+
+def test_budget_without_spill_dir_drops_sessions(clock):
+    manager = main.SessionManager(10 ** 6, 60)
+    manager.start(1)
+    fill(manager, 1)
+    clock.advance(1)
+    manager.start(2)
+    manager.memory_budget = manager.total_size - 1
+    fill(manager, 2)
+    assert manager.get(1) is None
+    assert manager.memory_usage()["spilled"] == 0
+
+
+def test_single_session_may_exceed_budget(clock):
+    manager = main.SessionManager(100, 60)
+    manager.start(1)
+    fill(manager, 1)
+    assert manager.get(1) is not None
+
+
+def test_idle_sessions_expire_in_memory_and_on_disk(clock, tmp_path):
+    manager = main.SessionManager(10 ** 6, 10, str(tmp_path))
+    manager.start(1)
+    fill(manager, 1)
+    clock.advance(1)
+    manager.start(2)
+    manager.memory_budget = manager.total_size - 1
+    fill(manager, 2)
+    assert (tmp_path / "1.json").exists()
+
+    clock.advance(11)
+    manager.evict_idle()
+
+    assert manager.memory_usage() == {
+        "total": 0, "budget": manager.memory_budget, "in_memory": 0, "spilled": 0, "sessions": {},
+    }
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spilled_sessions_expire_oldest_first(clock, tmp_path):
+    manager = main.SessionManager(1, 20, str(tmp_path))
+    for user_id in (1, 2, 3, 4):
+        manager.start(user_id)
+        clock.advance(5)
+    assert list(manager._spilled) == [1, 2, 3]
+
+    clock.advance(8)
+    manager.evict_idle()
+
+    assert list(manager._spilled) == [3]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["3.json"]
+    assert list(manager.memory_usage()["sessions"]) == [4]
+
+
+def test_get_refreshes_idle_timer(clock):
+    manager = main.SessionManager(10 ** 6, 10)
+    manager.start(1)
+    manager.start(2)
+    clock.advance(6)
+    manager.get(1)
+    clock.advance(6)
+    manager.evict_idle()
+    assert list(manager.memory_usage()["sessions"]) == [1]
+
+
+def test_restored_session_counts_as_active(clock, tmp_path):
+    manager = main.SessionManager(10 ** 6, 10, str(tmp_path))
+    manager.start(1)
+    fill(manager, 1)
+    clock.advance(1)
+    manager.start(2)
+    manager.memory_budget = manager.total_size - 1
+    fill(manager, 2)
+    clock.advance(8)
+
+    manager.memory_budget = 10 ** 6
+    assert manager.get(1) is not None
+    clock.advance(5)
+    manager.evict_idle()
+    assert list(manager.memory_usage()["sessions"]) == [1]
+
+
+def test_append_after_expiry_starts_new_session(clock):
+    manager = main.SessionManager(10 ** 6, 10)
+    manager.start(1)
+    fill(manager, 1)
+    clock.advance(11)
+    manager.append(1, "user", "снова")
+    assert manager.get(1).messages() == [{"role": "user", "content": "снова"}]
+
+
+def test_end_and_clear_spilled_remove_files(clock, tmp_path):
+    manager = main.SessionManager(10 ** 6, 60, str(tmp_path))
+    manager.start(1)
+    fill(manager, 1)
+    clock.advance(1)
+    manager.start(2)
+    manager.memory_budget = manager.total_size - 1
+    fill(manager, 2)
+    manager.end(1)
+    assert not (tmp_path / "1.json").exists()
+
+    (tmp_path / "42.json").write_text("[]", encoding="utf-8")
+    manager.clear_spilled()
+    assert not (tmp_path / "42.json").exists()